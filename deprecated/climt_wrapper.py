@@ -1,7 +1,9 @@
 """Adapted from https://github.com/CliMT/climt/blob/develop/examples/full_radiation_gcm_energy_balanced.py
 """ # 'C:\Users\colem\AppData\Local\Programs\Python\Python37\Scripts'
 
+import os
 import sys
+import threading
 sys.path.append(r'C:\Users\colem\AppData\Local\Programs\Python\Python37\Scripts')
 sys.path.append(r'C:\Users\colem\AppData\Roaming\Python\Python37\site-packages\climt\_components\simple_physics')
 
@@ -12,28 +14,31 @@ from sympl import (
 import numpy as np
 from datetime import timedelta
 import pygame
-from matplotlib import cm
-hot = cm.get_cmap('hot')
+from grid import Grid
+from render import temperature_rgb, blit_grid
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'research'))
+from snapshot import SnapshotStore
 
 # global display constants
 
 
-NUM_ROWS = 62
-NUM_COLS = 128
-NUM_TILES = NUM_ROWS*NUM_COLS
-TILE_WIDTH = 5
+GRID = Grid(num_rows=62, num_cols=128, tile_width=5)
 LOOP_MS = 150  # ms per frame
 CURRENT_DRAW = 'alt'
+STEPS_PER_RENDER = 6  # dycore steps between redraws
+OUTPUT_INTERVAL = 6  # dycore steps between stored outputs
+BUFFER_LENGTH = 8  # outputs of each displayed field kept in memory
 
 
 # Set up the climate model
 
+fields_to_display = ['surface_temperature']  # ring-buffered in memory
 fields_to_store = ['air_temperature', 'air_pressure', 'eastward_wind',
                    'northward_wind', 'air_pressure_on_interface_levels',
                    'surface_pressure', 'upwelling_longwave_flux_in_air',
                    'specific_humidity', 'surface_temperature',
-                   'latitude', 'longitude',
-                   'convective_heating_rate']
+                   'convective_heating_rate']  # appended to the snapshot store, if any
+static_fields = ['latitude', 'longitude']  # saved to the snapshot store once
 
 climt.set_constants_from_dict({
     'stellar_irradiance': {'value': 200, 'units': 'W m^-2'}})
@@ -59,7 +64,7 @@ dycore = climt.GFSDynamicalCore(
     [simple_physics, slab_surface, radiation_sw,
      radiation_lw, convection], number_of_damped_levels=5
 )
-grid = climt.get_grid(nx=NUM_COLS, ny=NUM_ROWS)
+grid = climt.get_grid(nx=GRID.num_cols, ny=GRID.num_rows)
 
 # Create model state
 my_state = climt.get_default_state([dycore], grid_state=grid)
@@ -79,36 +84,129 @@ my_state['ocean_mixed_layer_thickness'].values[:] = 50
 surf_temp_profile = 290 - (40*np.sin(zenith_angle)**2)
 my_state['surface_temperature'].values = surf_temp_profile
 
-def draw_temperature(screen, state, alpha=0.1):
-    """Draw temperature from climt state
+class ClimtDriver:
+    """Steps a climt dycore in batches and keeps only the fields it is asked for
+
+    Every output_interval steps the values of fields (the displayed, usually 2-D, ones)
+    are copied into preallocated ring buffers of buffer_length outputs, and, if store_path
+    is given, the values of store_fields are appended to a SnapshotStore there (and
+    static_fields, which never change, are saved to it once). Nothing else of the sympl state is
+    copied. start() runs the dycore on a background thread, steps_per_render steps per
+    batch, so the display only ever reads the buffers and never holds up the radiation
+    and convection components.
+    """
+
+    def __init__(self, dycore, state, time_step, fields=fields_to_display, store_fields=fields_to_store,
+                 steps_per_render=STEPS_PER_RENDER, output_interval=OUTPUT_INTERVAL, buffer_length=BUFFER_LENGTH,
+                 store_path=None, static_fields=static_fields):
+        self.dycore = dycore
+        self.state = state
+        self.time_step = time_step
+        self.fields = list(fields)
+        self.store_fields = list(store_fields)
+        self.static_fields = list(static_fields)
+        self.steps_per_render = steps_per_render
+        self.output_interval = output_interval
+        self.buffer_length = buffer_length
+        self.store = None if store_path is None else SnapshotStore(store_path)
+        self.steps = 0
+        self.outputs = 0
+        self.buffers = None  # allocated on the first output, once diagnostics are in the state
+        self.times = [None] * buffer_length
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    def step(self, n_steps=1):
+        for _ in range(n_steps):
+            diag, self.state = self.dycore(self.state, self.time_step)
+            self.state.update(diag)
+            self.state['time'] += self.time_step
+            self.steps += 1
+            if self.steps % self.output_interval == 0:
+                self.output()
+        return
+
+    def output(self):
+        """Copy the displayed fields into the next ring buffer slot and store the stored ones
+        """
+        values = {name: np.asarray(self.state[name].values) for name in self.fields}
+        if self.buffers is None:
+            self.buffers = {
+                name: np.empty((self.buffer_length,) + value.shape, dtype=value.dtype)
+                for name, value in values.items()
+            }
+        slot = self.outputs % self.buffer_length
+        with self._lock:
+            for name, value in values.items():
+                self.buffers[name][slot] = value
+            self.times[slot] = self.state['time']
+            self.outputs += 1
+        if self.store is not None:
+            if self.outputs == 1:
+                self.store.save({name: np.asarray(self.state[name].values) for name in self.static_fields})
+            self.store.append({name: np.asarray(self.state[name].values) for name in self.store_fields})
+        return
+
+    def latest(self, name):
+        """Copy of the most recent output of a displayed field, or None before the first output
+        """
+        with self._lock:
+            if self.outputs == 0:
+                return None
+            return self.buffers[name][(self.outputs - 1) % self.buffer_length].copy()
+
+    def history(self, name):
+        """Buffered outputs of a displayed field, oldest first
+        """
+        with self._lock:
+            count = min(self.outputs, self.buffer_length)
+            order = (self.outputs - count + np.arange(count)) % self.buffer_length
+            return self.buffers[name][order] if count else None
+
+    def _run(self):
+        while self._running:
+            self.step(self.steps_per_render)
+
+    def start(self):
+        """Step in batches on a background thread until stop()
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="ClimtDriver", daemon=True)
+        self._thread.start()
+        return
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return
+
+
+def draw_temperature(screen, surface_temperature, grid=GRID):
+    """Draw a surface temperature field (as stored by ClimtDriver)
     """
-    temp_vector = state["surface_temperature"]
-    for i in range(NUM_ROWS):
-        for j in range(NUM_COLS):
-            tile_x = j * TILE_WIDTH
-            tile_y = i * TILE_WIDTH
-            temp = temp_vector[i * NUM_COLS + j]
-            temp_pct = max(0, min(1, temp / 1000))
-            if temp_pct >= 1:
-                color = (255, 255, 255, alpha)
-            else :
-                htmp = hot(temp_pct)
-                color = (int(255*htmp[0]), int(255*htmp[1]), int(255*htmp[2]), alpha)
-                # if temp_pct > 0.1: print(color)
-            pygame.draw.rect(screen, color, (tile_x, tile_y, TILE_WIDTH, TILE_WIDTH))
+    temp_vector = np.asarray(surface_temperature).ravel()
+    blit_grid(screen, temperature_rgb(temp_vector, grid.num_rows, grid.num_cols))
     return
 
 if __name__ == "__main__":
     pygame.init()
     pygame.font.init()
 
-    size = width, height = NUM_COLS*TILE_WIDTH, NUM_ROWS*TILE_WIDTH
+    size = width, height = GRID.screen_size
     screen = pygame.display.set_mode(size)
 
+    driver = ClimtDriver(dycore, my_state, model_time_step)
+    driver.start()
     while True:
-        diag, my_state = dycore(my_state, model_time_step)
-        my_state.update(diag)
-        my_state['time'] += model_time_step
-
-        draw_temperature(screen, my_state, alpha=0.1)
-        pygame.display.flip()
\ No newline at end of file
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                driver.stop()
+                sys.exit()
+        surface_temperature = driver.latest('surface_temperature')
+        if surface_temperature is not None:
+            draw_temperature(screen, surface_temperature)
+            pygame.display.flip()
+        pygame.time.wait(LOOP_MS)
\ No newline at end of file
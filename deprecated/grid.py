@@ -0,0 +1,67 @@
+"""Lat/lon tile grids
+
+A Grid carries the resolution and display tile size that used to be module constants,
+so models at several resolutions can live in one process.
+"""
+from dataclasses import dataclass, field
+import numpy as np
+
+
+@dataclass(frozen=True)
+class Grid:
+    """num_rows latitude bands by num_cols longitudes (2 * num_rows by default)
+
+    Tiles are numbered row by row: tile (i, j) has index i * num_cols + j.
+    """
+    num_rows: int = 30
+    num_cols: int = None
+    tile_width: int = 15
+    num_tiles: int = field(init=False)
+
+    def __post_init__(self):
+        if self.num_cols is None:
+            object.__setattr__(self, 'num_cols', 2 * self.num_rows)
+        object.__setattr__(self, 'num_tiles', self.num_rows * self.num_cols)
+
+    @property
+    def screen_size(self):
+        return self.num_cols * self.tile_width, self.num_rows * self.tile_width
+
+    def index(self, row, col):
+        return row * self.num_cols + col % self.num_cols
+
+    def lonlat(self, i, j):
+        return ((i + 0.5) * (np.pi/2)/self.num_rows, (j + 0.5) * 2 * np.pi / self.num_cols)
+
+    def tile_coordinates(self):
+        """Row, column and flat index of every tile, as arrays
+        """
+        base_idx = np.arange(self.num_tiles)
+        i, j = np.divmod(base_idx, self.num_cols)
+        return i, j, base_idx
+
+    def latitude_bands(self, num_bands):
+        """Tile index boundaries splitting the grid into num_bands bands of whole rows
+        """
+        rows = np.linspace(0, self.num_rows, min(num_bands, self.num_rows) + 1).round().astype(int)
+        return rows * self.num_cols
+
+    def interpolate(self, values, target):
+        """Bilinearly interpolate a tile vector onto the target grid
+
+        Longitude wraps around; latitude is clamped at the first and last rows.
+        """
+        values = np.asarray(values).reshape(self.num_rows, self.num_cols)
+        row = (np.arange(target.num_rows) + 0.5) * self.num_rows / target.num_rows - 0.5
+        col = (np.arange(target.num_cols) + 0.5) * self.num_cols / target.num_cols - 0.5
+        row = np.clip(row, 0, self.num_rows - 1)
+        row0 = np.minimum(np.floor(row).astype(int), self.num_rows - 2) if self.num_rows > 1 else np.zeros(len(row), int)
+        row1 = np.minimum(row0 + 1, self.num_rows - 1)
+        row_frac = (row - row0)[:, None]
+        col0 = np.floor(col).astype(int)
+        col_frac = (col - col0)[None, :]
+        col0 %= self.num_cols
+        col1 = (col0 + 1) % self.num_cols
+        top = values[row0][:, col0] * (1 - col_frac) + values[row0][:, col1] * col_frac
+        bottom = values[row1][:, col0] * (1 - col_frac) + values[row1][:, col1] * col_frac
+        return (top * (1 - row_frac) + bottom * row_frac).ravel()
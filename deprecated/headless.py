@@ -0,0 +1,147 @@
+"""Headless runner for the energy-balance model in main.py
+
+Integrates without a pygame window or frame throttling, either to a fixed number of
+steps or until the temperature reaches a steady state, and runs ensembles of parameter
+sets across a process pool. Sparse operators are built once in the parent process and
+handed to every worker, rather than rebuilt per parameter set.
+
+    python headless.py --solar-const 4000 5000 6000 --steps 20000 --tol 1e-6
+"""
+import argparse
+import itertools
+from dataclasses import dataclass, asdict
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+from main import (
+    GRID, SOLAR_CONST,
+    construct_diffusion_matrix, construct_transport_matrix,
+    load_or_construct, EnergyBalanceModel,
+)
+from grid import Grid
+
+
+@dataclass
+class RunParameters:
+    """One point of a parameter sweep
+    """
+    solar_const: float = SOLAR_CONST
+    diffusion_coeff: float = 0.5
+    windspeed: float = 0.05
+    initial_temp: float = 280
+
+
+def build_operators(param_sets, grid=GRID):
+    """Build (or load from the operator cache) every distinct operator needed by param_sets
+    """
+    operators = {}
+    for params in param_sets:
+        key = ('diffusion', params.diffusion_coeff)
+        if key not in operators:
+            operators[key] = load_or_construct(
+                'diffusion', construct_diffusion_matrix, params.diffusion_coeff, grid)
+        key = ('transport', params.windspeed)
+        if key not in operators:
+            operators[key] = load_or_construct(
+                'transport', construct_transport_matrix, params.windspeed, grid)
+    return operators
+
+
+def run(params, n_steps=10000, tol=None, check_every=100, dt=0.001, alt_vector=None,
+        operators=None, grid=GRID, spin_up=False, dtype=np.float64, num_bands=None,
+        radiative_tol=None):
+    """Integrate one parameter set as fast as possible
+
+    Stops after n_steps, or earlier once the largest per-step temperature change
+    (averaged over check_every steps) falls below tol. With spin_up, the model is first
+    brought to equilibrium by EnergyBalanceModel.spin_up.
+    """
+    if operators is None:
+        operators = build_operators([params], grid)
+    model = EnergyBalanceModel(
+        grid, params.solar_const, params.diffusion_coeff, params.windspeed, dt=dt,
+        alt_vector=alt_vector, temp_vector=params.initial_temp * np.ones(grid.num_tiles),
+        diffusion_matrix=operators[('diffusion', params.diffusion_coeff)],
+        transport_matrix=operators[('transport', params.windspeed)],
+        dtype=dtype, num_bands=num_bands, tol=radiative_tol,
+    )
+    with model:
+        if spin_up:
+            model.spin_up(tol=tol or 1e-6)
+        stepper = model.stepper
+        steps = 0
+        converged = False
+        previous = stepper.temperature.copy()
+        while steps < n_steps and not converged:
+            batch = min(check_every, n_steps - steps)
+            stepper.step(batch)
+            steps += batch
+            if tol is not None:
+                converged = np.max(np.abs(stepper.temperature - previous)) / batch < tol
+                previous[:] = stepper.temperature
+    return {
+        'params': asdict(params),
+        'steps': steps,
+        'converged': converged,
+        'mean_temp': float(np.mean(stepper.temperature)),
+        'temperature': stepper.temperature,
+    }
+
+
+_worker_operators = None
+
+
+def _init_worker(operators):
+    global _worker_operators
+    _worker_operators = operators
+
+
+def _run_in_worker(params, **kwargs):
+    return run(params, operators=_worker_operators, **kwargs)
+
+
+def run_ensemble(param_sets, processes=None, grid=GRID, **kwargs):
+    """Run every parameter set in param_sets on a process pool, in order
+
+    Keyword arguments are passed on to run().
+    """
+    param_sets = list(param_sets)
+    operators = build_operators(param_sets, grid)
+    worker = partial(_run_in_worker, grid=grid, **kwargs)
+    with Pool(processes, initializer=_init_worker, initargs=(operators,)) as pool:
+        return pool.map(worker, param_sets)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--solar-const', type=float, nargs='+', default=[SOLAR_CONST])
+    parser.add_argument('--diffusion', type=float, nargs='+', default=[0.5])
+    parser.add_argument('--windspeed', type=float, nargs='+', default=[0.05])
+    parser.add_argument('--initial-temp', type=float, nargs='+', default=[280])
+    parser.add_argument('--rows', type=int, default=GRID.num_rows, help='latitude bands of the grid')
+    parser.add_argument('--steps', type=int, default=10000)
+    parser.add_argument('--tol', type=float, default=None)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--spin-up', action='store_true', help='step until the ice edge settles, then solve to equilibrium')
+    parser.add_argument('--precision', choices=['float64', 'float32'], default='float64')
+    parser.add_argument('--bands', type=int, default=None, help='step this many latitude bands on threads')
+    parser.add_argument('--radiative-tol', type=float, default=None,
+                        help='sub-step the radiative term to this local error (K) instead of one explicit step')
+    parser.add_argument('--output', default=None, help='save final temperatures to this .npz file')
+    args = parser.parse_args()
+
+    param_sets = [
+        RunParameters(*values) for values in itertools.product(
+            args.solar_const, args.diffusion, args.windspeed, args.initial_temp)
+    ]
+    results = run_ensemble(param_sets, processes=args.processes, grid=Grid(args.rows),
+                           n_steps=args.steps, tol=args.tol, spin_up=args.spin_up,
+                           dtype=np.dtype(args.precision), num_bands=args.bands,
+                           radiative_tol=args.radiative_tol)
+    for result in results:
+        print(result['params'], 'steps:', result['steps'], 'converged:', result['converged'],
+              'mean temp:', result['mean_temp'])
+    if args.output is not None:
+        np.savez(args.output, temperature=np.array([result['temperature'] for result in results]))
@@ -1,21 +1,31 @@
+import os
 import sys
-import csv
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from time import monotonic, sleep
 import pygame
-import numba as nb
 from scipy import sparse
-from matplotlib import cm
-hot = cm.get_cmap('hot')
+from scipy.sparse.linalg import spsolve
+from grid import Grid
+from render import temperature_rgb, altitude_rgb, blit_grid
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'research'))
+from snapshot import SnapshotStore
+from recorder import Recorder
+from profiling import PhaseTimer, draw_overlay
+import kernels
 
 # global constants
 
-NUM_ROWS = 30
-NUM_COLS = 2*NUM_ROWS
-NUM_TILES = NUM_ROWS*NUM_COLS
-TILE_WIDTH = 15
+GRID = Grid(num_rows=30, tile_width=15)  # default grid of the interactive window
 LOOP_MS = 150  # ms per frame
 CURRENT_DRAW = 'alt'
+RECORD_STRIDE = 5  # steps per recorded animation frame
+RADIATIVE_TOL = 0.05  # kelvin per step, local error of the radiative sub-steps
+PROFILE_NOTE = ("ticks with albedo/radiation/diffusion/transport ran the unfused step_phases "
+                "(profile overlay on); 'step' is the fused production step")
+OPERATOR_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'operator_cache')
+OPERATOR_CACHE_VERSION = 1  # bump when the operator construction changes
 
 # geophysical constants
 SOLAR_CONST = 5000
@@ -37,8 +47,8 @@ def haversine(lon1, lat1, lon2, lat2):
     r = 1 # 6371 # Radius of earth in kilometers. Use 3956 for miles
     return c * r
 
-def lonlat(i, j):
-    return ((i + 0.5) * (np.pi/2)/NUM_ROWS, (j + 0.5) * 2 * np.pi / NUM_COLS)
+def lonlat(i, j, grid=GRID):
+    return grid.lonlat(i, j)
 
 def transport_vector(lon, lat):
     if lat < np.pi/6: return (-1, -1)
@@ -51,105 +61,129 @@ def transport_vector(lon, lat):
 def construct_world():
     return
 
-def load_world(filename="world.csv"):
-    with open(filename, "r") as f:
-        rdr = csv.reader(f, delimiter=",")
-        alt_vector = [alt for row in rdr for alt in row]
-    return np.array(alt_vector)
-
-def save_world(alt_vector, filename="world.csv"):
-    with open(filename, "w+") as f:
-        wrt = csv.writer(f, delimiter=",")
-        for j in range(NUM_ROWS):
-            row_to_write = [alt_vector[j*NUM_COLS + i] for i in range(NUM_COLS)]
-            wrt.writerow(row_to_write)
+def load_state(path="world", names=None, grid=GRID):
+    """Load state vectors (all saved ones if names is None) from a snapshot store
+
+    Raises FileNotFoundError if nothing was saved at path, ValueError if it holds another grid.
+    """
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        raise FileNotFoundError(f"no saved state at {path}")
+    store = SnapshotStore(path)
+    shape = (store.metadata.get('num_rows'), store.metadata.get('num_cols'))
+    if shape != (grid.num_rows, grid.num_cols):
+        raise ValueError(f"{path} holds a {shape[0]}x{shape[1]} grid, expected {grid.num_rows}x{grid.num_cols}")
+    return {name: np.array(value) for name, value in store.load(names).items()}
+
+def save_state(path="world", grid=GRID, **fields):
+    """Save state vectors (altitude=..., temperature=..., ...) to a snapshot store
+    """
+    SnapshotStore(path).save(fields, num_rows=grid.num_rows, num_cols=grid.num_cols)
     return
 
-def construct_diffusion_matrix(diffusion_coeff=0.3):
-    A = sparse.lil_matrix((NUM_TILES, NUM_TILES))
-    for i in range(NUM_ROWS):
-        for j in range(NUM_COLS):
-            base_idx = i * NUM_COLS + j
-            north_idx = (i - 1) * NUM_COLS + j
-            south_idx = (i + 1) * NUM_COLS + j
-            east_idx = i * NUM_COLS + (j + 1) % NUM_COLS
-            west_idx = i * NUM_COLS + (j - 1) % NUM_COLS
-            base_lon, base_lat = lonlat(i, j)
-            north_lon, north_lat = lonlat(j, i-1)
-            south_lon, south_lat = lonlat(j, i+1)
-            east_lon, east_lat = lonlat(j+1, i)
-            west_lon, west_lat = lonlat(j-1, i)
-            tonorth = haversine(base_lon, base_lat, north_lon, north_lat) if i > 0 else 0
-            tosouth = haversine(base_lon, base_lat, south_lon, south_lat) if i < NUM_ROWS else 0
-            toeast = haversine(base_lon, base_lat, east_lon, east_lat)
-            towest = haversine(base_lon, base_lat, west_lon, west_lat)
-            if i == 0:
-                totaldist = 1/tosouth + 1/toeast + 1/towest
-            elif i == NUM_ROWS:
-                totaldist = 1/tonorth + 1/toeast + 1/towest
-            else:
-                totaldist = 1/tonorth + 1/tosouth + 1/toeast + 1/towest
-            if i > 0: A[north_idx, base_idx] += diffusion_coeff * (1/tonorth) / totaldist
-            if i < NUM_ROWS - 1: A[south_idx, base_idx] += diffusion_coeff * (1/tosouth) / totaldist
-            A[east_idx, base_idx] += diffusion_coeff * (1/toeast) / totaldist
-            A[west_idx, base_idx] += diffusion_coeff * (1/towest) / totaldist
-            A[base_idx, base_idx] = 1 - diffusion_coeff
-    for r in range(NUM_TILES):
-        A[r, :] = A[r, :]/np.sum(A[r, :])
-    return A
+def load_world(path="world", grid=GRID):
+    """Altitude vector from a snapshot store, or from a legacy .csv file
+    """
+    if path.endswith(".csv"):
+        return np.loadtxt(path, delimiter=",", ndmin=2).ravel()
+    return load_state(path, ['altitude'], grid)['altitude']
+
+def save_world(alt_vector, path="world", grid=GRID):
+    save_state(path, grid, altitude=alt_vector)
+    return
+
+def operator_cache_path(name, coeff, grid=GRID):
+    return os.path.join(OPERATOR_CACHE_DIR,
+                        f"{name}_v{OPERATOR_CACHE_VERSION}_{grid.num_rows}x{grid.num_cols}_{coeff}.npz")
 
-def construct_transport_matrix(windspeed=0.2):
-    A = sparse.lil_matrix((NUM_TILES, NUM_TILES))
-    for i in range(NUM_ROWS):
-        for j in range(NUM_COLS):
-            base_idx = i * NUM_COLS + j
-            north_idx = (i - 1) * NUM_COLS + j
-            south_idx = (i + 1) * NUM_COLS + j
-            west_idx = i * NUM_COLS + (j - 1) % NUM_COLS
-            base_lon, base_lat = lonlat(j, i)
-            north_lon, north_lat = lonlat(j, i-1)
-            south_lon, south_lat = lonlat(j+1, i)
-            west_lon, west_lat = lonlat(j-1, i)
-            if ((base_lat < np.pi/6)
-                or (base_lat >= np.pi/3 and base_lat < np.pi/2)
-                or (base_lat >= 2*np.pi/3 and base_lat < 5*np.pi/6)): # (-1, -1)
-                tosouth = 1 / haversine(base_lon, base_lat, south_lon, south_lat) if i < NUM_ROWS-2 else 0
-                towest = 1 / haversine(base_lon, base_lat, west_lon, west_lat)
-                try:
-                    totaldist = tosouth + towest
-                    A[west_idx, base_idx] += windspeed * (towest / totaldist)
-                    A[south_idx, base_idx] += windspeed * (tosouth / totaldist)
-                    A[base_idx, base_idx] = 1 - windspeed
-                except ZeroDivisionError:
-                    print('ZeroDivisionError')
-                    print('base:', base_idx, base_lon, base_lat)
-                    print('south:', south_idx, south_lon, south_lat, tosouth)
-                    print('west:', west_idx, west_lon, west_lat, towest)
-            else: #return (-1, 1)
-                tonorth = 1 / haversine(base_lon, base_lat, north_lon, north_lat) if i > 0 else 0
-                towest = 1 / haversine(base_lon, base_lat, west_lon, west_lat)
-                try:
-                    totaldist = tonorth + towest
-                    A[west_idx, base_idx] += windspeed * (towest / totaldist)
-                    A[north_idx, base_idx] += windspeed * (tonorth / totaldist)
-                    A[base_idx, base_idx] = 1 - windspeed
-                except ZeroDivisionError:
-                    print('ZeroDivisionError')
-                    print('base:', base_idx, base_lon, base_lat)
-                    print('north:', north_idx, north_lon, north_lat, tonorth)
-                    print('west:',west_idx, west_lon, west_lat, towest)
-    for r in range(NUM_TILES):
-        A[:, r] = A[:, r]/np.sum(A[:, r])
+def load_or_construct(name, constructor, coeff, grid=GRID):
+    """Load a sparse operator from the on-disk cache, building and saving it on a miss
+    """
+    path = operator_cache_path(name, coeff, grid)
+    if os.path.exists(path):
+        return sparse.load_npz(path).tocsr()
+    A = constructor(coeff, grid)
+    os.makedirs(OPERATOR_CACHE_DIR, exist_ok=True)
+    # write then rename, so concurrent runs never load a half-written file
+    tmp_path = f"{path}.tmp{os.getpid()}.npz"
+    sparse.save_npz(tmp_path, A)
+    os.replace(tmp_path, path)
     return A
 
+def construct_diffusion_matrix(diffusion_coeff=0.3, grid=GRID):
+    num_rows, num_cols = grid.num_rows, grid.num_cols
+    i, j, base_idx = grid.tile_coordinates()
+    north_idx = (i - 1) * num_cols + j
+    south_idx = (i + 1) * num_cols + j
+    east_idx = i * num_cols + (j + 1) % num_cols
+    west_idx = i * num_cols + (j - 1) % num_cols
+    base_lon, base_lat = lonlat(j, i, grid)
+    north_lon, north_lat = lonlat(j, i-1, grid)
+    south_lon, south_lat = lonlat(j, i+1, grid)
+    east_lon, east_lat = lonlat(j+1, i, grid)
+    west_lon, west_lat = lonlat(j-1, i, grid)
+    has_north = i > 0
+    has_south = i < num_rows - 1
+    # inverse distances; the north pole row has no northern neighbor
+    inv_north = np.where(has_north, 1 / haversine(base_lon, base_lat, north_lon, north_lat), 0)
+    inv_south = 1 / haversine(base_lon, base_lat, south_lon, south_lat)
+    inv_east = 1 / haversine(base_lon, base_lat, east_lon, east_lat)
+    inv_west = 1 / haversine(base_lon, base_lat, west_lon, west_lat)
+    totaldist = inv_north + inv_south + inv_east + inv_west
+    rows = np.concatenate([north_idx[has_north], south_idx[has_south], east_idx, west_idx, base_idx])
+    cols = np.concatenate([base_idx[has_north], base_idx[has_south], base_idx, base_idx, base_idx])
+    vals = np.concatenate([
+        diffusion_coeff * (inv_north / totaldist)[has_north],
+        diffusion_coeff * (inv_south / totaldist)[has_south],
+        diffusion_coeff * inv_east / totaldist,
+        diffusion_coeff * inv_west / totaldist,
+        np.full(len(base_idx), 1 - diffusion_coeff),
+    ])
+    num_tiles = grid.num_tiles
+    A = sparse.coo_matrix((vals, (rows, cols)), shape=(num_tiles, num_tiles)).tocsr()
+    # normalize rows so that each tile's new temperature is a weighted mean
+    return sparse.diags(1 / np.asarray(A.sum(axis=1)).ravel()).dot(A).tocsr()
+
+def construct_transport_matrix(windspeed=0.2, grid=GRID):
+    num_rows, num_cols = grid.num_rows, grid.num_cols
+    i, j, base_idx = grid.tile_coordinates()
+    north_idx = (i - 1) * num_cols + j
+    south_idx = (i + 1) * num_cols + j
+    west_idx = i * num_cols + (j - 1) % num_cols
+    base_lon, base_lat = lonlat(j, i, grid)
+    north_lon, north_lat = lonlat(j, i-1, grid)
+    south_lon, south_lat = lonlat(j, i+1, grid)
+    west_lon, west_lat = lonlat(j-1, i, grid)
+    # bands where the wind blows (-1, -1) carry heat south, the others (-1, 1) north
+    southward = ((base_lat < np.pi/6)
+                 | ((base_lat >= np.pi/3) & (base_lat < np.pi/2))
+                 | ((base_lat >= 2*np.pi/3) & (base_lat < 5*np.pi/6)))
+    has_south = southward & (i < num_rows - 2)
+    has_north = ~southward & (i > 0)
+    with np.errstate(divide="ignore"):
+        tosouth = np.where(has_south, 1 / haversine(base_lon, base_lat, south_lon, south_lat), 0)
+        tonorth = np.where(has_north, 1 / haversine(base_lon, base_lat, north_lon, north_lat), 0)
+    towest = 1 / haversine(base_lon, base_lat, west_lon, west_lat)
+    totaldist = tosouth + tonorth + towest
+    rows = np.concatenate([west_idx, south_idx[has_south], north_idx[has_north], base_idx])
+    cols = np.concatenate([base_idx, base_idx[has_south], base_idx[has_north], base_idx])
+    vals = np.concatenate([
+        windspeed * towest / totaldist,
+        windspeed * (tosouth / totaldist)[has_south],
+        windspeed * (tonorth / totaldist)[has_north],
+        np.full(len(base_idx), 1 - windspeed),
+    ])
+    num_tiles = grid.num_tiles
+    A = sparse.coo_matrix((vals, (rows, cols)), shape=(num_tiles, num_tiles)).tocsr()
+    # normalize columns so that transport conserves heat
+    return A.dot(sparse.diags(1 / np.asarray(A.sum(axis=0)).ravel())).tocsr()
+
+def construct_insolation_vector(solar_const=SOLAR_CONST, grid=GRID):
+    i, j, _ = grid.tile_coordinates()
+    lat = grid.lonlat(j, i)[1]
+    return solar_const * np.sin(lat)
+
 def construct_insolation_matrix():
-    I = sparse.lil_matrix((NUM_TILES, NUM_TILES))
-    for i in range(NUM_ROWS):
-        for j in range(NUM_COLS):
-            base_idx = i * NUM_COLS + j
-            lat = lonlat(j, i)[1]
-            I[base_idx, base_idx] = SOLAR_CONST * np.sin(lat)
-    return I
+    return sparse.diags(construct_insolation_vector()).tolil()
 
 def construct_rainfall_matrix():
     return
@@ -157,45 +191,24 @@ def construct_rainfall_matrix():
 def update_state():
     return
 
-def draw_temperature(screen, temp_vector, alpha=1):
-    for i in range(NUM_ROWS):
-        for j in range(NUM_COLS):
-            tile_x = j * TILE_WIDTH
-            tile_y = i * TILE_WIDTH
-            temp = temp_vector[i * NUM_COLS + j]
-            temp_pct = max(0, min(1, temp / 1000))
-            if temp_pct >= 1:
-                color = (255, 255, 255, alpha)
-            else :
-                htmp = hot(temp_pct)
-                color = (int(255*htmp[0]), int(255*htmp[1]), int(255*htmp[2]), alpha)
-                # if temp_pct > 0.1: print(color)
-            pygame.draw.rect(screen, color, (tile_x, tile_y, TILE_WIDTH, TILE_WIDTH))
+def draw_temperature(screen, temp_vector, grid=GRID):
+    blit_grid(screen, temperature_rgb(temp_vector, grid.num_rows, grid.num_cols))
     return
 
+def temperature_frame(temp_vector, grid=GRID):
+    rgb = temperature_rgb(temp_vector, grid.num_rows, grid.num_cols)
+    return rgb.repeat(grid.tile_width, axis=0).repeat(grid.tile_width, axis=1)
+
 def draw_humidity():
     return
 
 def draw_pressure():
     return
 
-def draw_altitude(screen, alt_vector, temp_vector):
-    for i in range(NUM_ROWS):
-        for j in range(NUM_COLS):
-            tile_x = j * TILE_WIDTH
-            tile_y = i * TILE_WIDTH
-            idx = i * NUM_COLS + j
-            alt = alt_vector[idx]
-            temp = temp_vector[idx]
-            if alt <= 0:    # ocean
-                if temp < 280:  # frozen
-                    pygame.draw.rect(screen, [245, 245, 245], (tile_x, tile_y, TILE_WIDTH, TILE_WIDTH))
-                else:
-                    pygame.draw.rect(screen, [135, 206, 235], (tile_x, tile_y, TILE_WIDTH, TILE_WIDTH))
-            else:   # land
-                alt_pct = 1 - max(0, min(1, alt / 10))
-                color = [int(alt_pct * 139), int(alt_pct * 69), int(alt_pct * 19)]
-                pygame.draw.rect(screen, color, (tile_x, tile_y, TILE_WIDTH, TILE_WIDTH))
+def draw_altitude(screen, alt_vector, temp_vector, grid=GRID):
+    # serial kernel: the model may be running parallel kernels on another thread
+    frozen = kernels.frozen(alt_vector, temp_vector, np.empty(len(alt_vector), dtype=bool))
+    blit_grid(screen, altitude_rgb(alt_vector, frozen, grid.num_rows, grid.num_cols))
     return
 
 def draw_index(screen, idx, x, y, font):
@@ -206,28 +219,348 @@ def draw_index(screen, idx, x, y, font):
     screen.blit(text, textrect)
     return
 
-def draw_indices(screen, font):
-    for i in range(NUM_ROWS):
-        for j in range(NUM_COLS):
-            idx = i * NUM_COLS + j
-            tilerect = pygame.Rect(j*TILE_WIDTH, i*TILE_WIDTH, TILE_WIDTH, TILE_WIDTH)
+def draw_indices(screen, font, grid=GRID):
+    tile_width = grid.tile_width
+    for i in range(grid.num_rows):
+        for j in range(grid.num_cols):
+            idx = i * grid.num_cols + j
+            tilerect = pygame.Rect(j*tile_width, i*tile_width, tile_width, tile_width)
             draw_index(screen, idx, tilerect.centerx, tilerect.centery, font)
     return
 
-@nb.njit(parallel=True)
+def compact_operator(A, dtype=np.float32):
+    """A as CSR with dtype values and int32 index arrays
+    """
+    A = sparse.csr_matrix(A, dtype=dtype)
+    A.indptr = A.indptr.astype(np.int32)
+    A.indices = A.indices.astype(np.int32)
+    return A
+
 def albedoize(alt, temp):
-    alb = np.empty(len(alt))
-    for i in nb.prange(len(alt)):
-        if alt[i] <= 0 and temp[i] > 280: alb[i] = 0.96
-        elif alt[i] <= 0 and temp[i] <= 280: alb[i] = 0.1
-        elif alt[i] > 0: alb[i] = 0.6
-    return alb
+    return kernels.albedo_serial(alt, temp, np.empty(len(alt)))
+
+class EnergyBalanceStepper:
+    """Time stepper for the energy-balance model
+
+    Diffusion and transport are fused into the single operator transport @ diffusion,
+    and the absorbed insolation for frozen/unfrozen tiles is cached until the altitude changes.
+    The temperature vector is advanced in place.
+
+    State vectors and operator values are stored as dtype, with int32 operator indices;
+    float32 halves the memory traffic per step (see the precision check in
+    research/benchmark.py for its accuracy against float64).
+
+    By default the radiative term takes one explicit Euler step of dt per step. With tol
+    (kelvin per step) it is integrated by linearized-implicit sub-steps instead, each tile
+    taking as many (up to max_substeps) as its local error estimate needs: calm tiles
+    take one, tiles made stiff by heat injections sub-step rather than overshoot.
+    The sub-steps taken by each tile in the last step are kept in substeps.
+    """
+
+    def __init__(self, diffusion_matrix, transport_matrix, insolation, alt_vector, temp_vector, dt=0.001,
+                 stefan_boltzmann=STEFAN_BOLTZMANN, dtype=np.float64, tol=None, max_substeps=64):
+        self.dtype = np.dtype(dtype)
+        diffusion = diffusion_matrix.tocsr()
+        transport = transport_matrix.tocsr()
+        self.diffusion = compact_operator(diffusion, self.dtype)
+        self.transport = compact_operator(transport, self.dtype)
+        self.operator = compact_operator(transport.dot(diffusion), self.dtype)
+        self.insolation = np.asarray(insolation, dtype=self.dtype)
+        self.dt = dt
+        self.stefan_boltzmann = stefan_boltzmann
+        self.tol = tol
+        self.max_substeps = max_substeps
+        self.temperature = np.array(temp_vector, dtype=self.dtype)
+        self.substeps = np.ones(len(self.temperature), dtype=np.int32)
+        self._buffer = np.empty_like(self.temperature)
+        self._scratch = np.empty_like(self.temperature)
+        self.set_altitude(alt_vector)
+
+    def set_altitude(self, alt_vector, tiles=None):
+        """Recompute the absorbed insolation; call after editing the altitude
+
+        If tiles is given, only those tiles were edited and only their entries are updated.
+        """
+        self.altitude = alt_vector
+        if tiles is None:
+            ocean = alt_vector <= 0
+            self._absorbed_warm = (np.where(ocean, kernels.OCEAN_ALBEDO, kernels.LAND_ALBEDO)
+                                   * self.insolation).astype(self.dtype)
+            self._absorbed_cold = (np.where(ocean, kernels.ICE_ALBEDO, kernels.LAND_ALBEDO)
+                                   * self.insolation).astype(self.dtype)
+            return
+        tiles = np.asarray(tiles, dtype=np.intp)
+        ocean = alt_vector[tiles] <= 0
+        insolation = self.insolation[tiles]
+        self._absorbed_warm[tiles] = np.where(ocean, kernels.OCEAN_ALBEDO, kernels.LAND_ALBEDO) * insolation
+        self._absorbed_cold[tiles] = np.where(ocean, kernels.ICE_ALBEDO, kernels.LAND_ALBEDO) * insolation
+
+    def step(self, n_steps=1):
+        sigma, dt = self.dtype.type(self.stefan_boltzmann), self.dtype.type(self.dt)
+        A = self.operator
+        if self.tol is None:
+            kernels.advance(self.temperature, self._buffer, self._absorbed_warm, self._absorbed_cold,
+                            A.indptr, A.indices, A.data, sigma, dt, n_steps)
+        else:
+            kernels.advance_adaptive(self.temperature, self._buffer, self.substeps,
+                                     self._absorbed_warm, self._absorbed_cold, A.indptr, A.indices, A.data,
+                                     sigma, dt, self.dtype.type(self.tol), self.max_substeps, n_steps)
+        return self.temperature
+
+    def residual(self, temp_vector=None):
+        """Change in temperature over one step from temp_vector (the current temperature by default)
+
+        Computed in float64 whatever the stepper's dtype.
+        """
+        temp = np.asarray(self.temperature if temp_vector is None else temp_vector, dtype=np.float64)
+        absorbed = np.where(temp > kernels.FREEZING_TEMP, self._absorbed_warm, self._absorbed_cold)
+        return self.operator.dot(temp + self.dt * (absorbed - self.stefan_boltzmann * temp**4)) - temp
+
+    def equilibrate(self, tol=1e-6, max_iter=50):
+        """Newton-solve for the steady state of step(), in place
+
+        Solves F(T) = M (T + dt (a - sigma T^4)) - T = 0 with the Jacobian
+        M (I - 4 dt sigma T^3) - I, holding the albedo fixed within each iteration. This is
+        the fixed point of the explicit step; with tol set, stepping settles to a state a
+        little away from it.
+        The iteration runs in float64. Returns the number of iterations taken, or None if
+        the residual is still above tol.
+        """
+        temp = self.temperature.astype(np.float64)
+        operator = self.operator.astype(np.float64)
+        identity = sparse.identity(len(temp), format='csr')
+        iterations = None
+        for iteration in range(max_iter):
+            residual = self.residual(temp)
+            if np.max(np.abs(residual)) < tol:
+                iterations = iteration
+                break
+            jacobian = operator.dot(sparse.diags(1 - 4 * self.dt * self.stefan_boltzmann * temp**3)) - identity
+            temp += spsolve(jacobian.tocsc(), -residual)
+        self.temperature[:] = temp
+        return iterations
+
+    def step_phases(self, timer):
+        """One unfused step, timing albedo, radiation, diffusion and transport separately
+
+        Slower than step(), which fuses the phases into one kernel; the breakdown shows
+        their relative cost, not the time of a production step.
+        """
+        with timer.phase('albedo'):
+            absorbed = kernels.albedo(self.altitude, self.temperature, self._scratch)
+            absorbed *= self.insolation
+        with timer.phase('radiation'):
+            if self.tol is None:
+                kernels.radiate(self.temperature, absorbed, absorbed, self.stefan_boltzmann, self.dt, self._buffer)
+            else:
+                kernels.radiate_adaptive(self.temperature, absorbed, absorbed, self.stefan_boltzmann, self.dt,
+                                         self.tol, self.max_substeps, self._buffer, self.substeps)
+        with timer.phase('diffusion'):
+            A = self.diffusion
+            kernels.csr_matvec(A.indptr, A.indices, A.data, self._buffer, self._scratch)
+        with timer.phase('transport'):
+            A = self.transport
+            kernels.csr_matvec(A.indptr, A.indices, A.data, self._scratch, self.temperature)
+        return self.temperature
+
+    def close(self):
+        return
+
+
+class BandedStepper(EnergyBalanceStepper):
+    """Energy-balance stepper split into latitude bands, stepped concurrently on threads
+
+    Each band owns a contiguous range of tiles (whole rows, from Grid.latitude_bands) and
+    the matching rows of the fused operator, re-indexed onto its halo: the range of tiles
+    those rows read, reaching a row or two into the neighbouring bands (longitude wraps
+    within a row). Every step a band radiates its halo into a private buffer and applies
+    its operator rows, reading the current temperature and writing the next one, so the
+    bands only meet at one barrier per step. kernels.band_step releases the GIL.
+    """
+
+    def __init__(self, diffusion_matrix, transport_matrix, insolation, alt_vector, temp_vector, bands,
+                 dt=0.001, stefan_boltzmann=STEFAN_BOLTZMANN, dtype=np.float64, tol=None, max_substeps=64):
+        super().__init__(diffusion_matrix, transport_matrix, insolation, alt_vector, temp_vector,
+                         dt=dt, stefan_boltzmann=stefan_boltzmann, dtype=dtype, tol=tol, max_substeps=max_substeps)
+        self._next = np.empty_like(self.temperature)
+        self.bands = []
+        A = self.operator
+        for lo, hi in zip(bands[:-1], bands[1:]):
+            start, stop = A.indptr[lo], A.indptr[hi]
+            columns = A.indices[start:stop]
+            halo_lo, halo_hi = int(columns.min()), int(columns.max()) + 1
+            self.bands.append((
+                lo, hi, halo_lo, halo_hi,
+                (A.indptr[lo:hi + 1] - start).astype(np.int32),
+                (columns - halo_lo).astype(np.int32),
+                A.data[start:stop],
+                np.empty(halo_hi - halo_lo, dtype=self.dtype),
+                np.ones(halo_hi - halo_lo, dtype=np.int32),
+            ))
+        self._executor = ThreadPoolExecutor(len(self.bands), thread_name_prefix='band')
+
+    def _step_band(self, band, n_steps, barrier):
+        lo, hi, halo_lo, halo_hi, indptr, indices, data, buf, substeps = band
+        sigma, dt = self.dtype.type(self.stefan_boltzmann), self.dtype.type(self.dt)
+        tol = None if self.tol is None else self.dtype.type(self.tol)
+        absorbed_warm = self._absorbed_warm[halo_lo:halo_hi]
+        absorbed_cold = self._absorbed_cold[halo_lo:halo_hi]
+        current, following = self.temperature, self._next
+        try:
+            for _ in range(n_steps):
+                if tol is None:
+                    kernels.band_step(current[halo_lo:halo_hi], following[lo:hi], buf, absorbed_warm, absorbed_cold,
+                                      indptr, indices, data, sigma, dt)
+                else:
+                    kernels.band_step_adaptive(current[halo_lo:halo_hi], following[lo:hi], buf, substeps,
+                                               absorbed_warm, absorbed_cold, indptr, indices, data,
+                                               sigma, dt, tol, self.max_substeps)
+                barrier.wait()
+                current, following = following, current
+        except BaseException:
+            barrier.abort()
+            raise
+
+    def step(self, n_steps=1):
+        barrier = threading.Barrier(len(self.bands))
+        futures = [self._executor.submit(self._step_band, band, n_steps, barrier) for band in self.bands]
+        for future in futures:
+            future.result()
+        if self.tol is not None:
+            for lo, hi, halo_lo, _, *_, substeps in self.bands:
+                self.substeps[lo:hi] = substeps[lo - halo_lo:hi - halo_lo]
+        if n_steps % 2:
+            self.temperature[:] = self._next
+        return self.temperature
+
+    def close(self):
+        """Shut down the band threads; the stepper can't step afterwards
+        """
+        self._executor.shutdown()
+        return
+
+
+class EnergyBalanceModel:
+    """Energy-balance model on one grid: its parameters, operators and state
+
+    Models are independent, so several resolutions can run in one process; interpolate_to
+    carries the state of a spun-up model over to another grid. With num_bands, the model
+    steps num_bands latitude bands concurrently (BandedStepper).
+    """
+
+    def __init__(self, grid=GRID, solar_const=SOLAR_CONST, diffusion_coeff=0.5, windspeed=0.05,
+                 stefan_boltzmann=STEFAN_BOLTZMANN, dt=0.001, alt_vector=None, temp_vector=None,
+                 diffusion_matrix=None, transport_matrix=None, dtype=np.float64, num_bands=None,
+                 tol=None, max_substeps=64):
+        self.grid = grid
+        self.solar_const = solar_const
+        self.diffusion_coeff = diffusion_coeff
+        self.windspeed = windspeed
+        self.num_bands = num_bands
+        if diffusion_matrix is None:
+            diffusion_matrix = load_or_construct('diffusion', construct_diffusion_matrix, diffusion_coeff, grid)
+        if transport_matrix is None:
+            transport_matrix = load_or_construct('transport', construct_transport_matrix, windspeed, grid)
+        if alt_vector is None:
+            alt_vector = np.zeros(grid.num_tiles)
+        if temp_vector is None:
+            temp_vector = 280 * np.ones(grid.num_tiles)
+        self.diffusion_matrix = diffusion_matrix
+        self.transport_matrix = transport_matrix
+        args = (diffusion_matrix, transport_matrix, construct_insolation_vector(solar_const, grid),
+                np.array(alt_vector, dtype=float), temp_vector)
+        if num_bands:
+            args += (grid.latitude_bands(num_bands),)
+        self.stepper = (BandedStepper if num_bands else EnergyBalanceStepper)(
+            *args, dt=dt, stefan_boltzmann=stefan_boltzmann, dtype=dtype, tol=tol, max_substeps=max_substeps)
+
+    @property
+    def altitude(self):
+        return self.stepper.altitude
+
+    @property
+    def temperature(self):
+        return self.stepper.temperature
+
+    def set_altitude(self, alt_vector, tiles=None):
+        self.stepper.set_altitude(alt_vector, tiles)
+
+    def step(self, n_steps=1):
+        return self.stepper.step(n_steps)
+
+    def equilibrate(self, tol=1e-6, max_iter=50):
+        return self.stepper.equilibrate(tol, max_iter)
+
+    def close(self):
+        """Release the stepper's threads, if it has any
+        """
+        self.stepper.close()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def spin_up(self, tol=1e-6, max_iter=50, settle_steps=500, check_every=10, max_steps=20000):
+        """Bring the temperature to equilibrium: step until the ice edge settles, then Newton-solve
+
+        The model has several equilibria that differ in which tiles freeze, and the one
+        plain stepping reaches is decided early, by the first few hundred steps on this
+        grid. So the model is stepped until the frozen set has held still for settle_steps
+        steps (checked every check_every), which fixes the albedo, and Newton then removes
+        the slow remainder of the transient. If the solve moves the ice edge (the edge had
+        not settled, or, with tol set, the explicit step's fixed point differs from the
+        stepper's near the edge), it is discarded and stepping resumes from the settled
+        state with twice the settling window, for at most max_steps steps in total.
+        Returns the Newton iterations of each solve.
+        """
+        iterations = []
+        steps = 0
+        while True:
+            frozen = self.temperature < kernels.FREEZING_TEMP
+            still = 0
+            while still < settle_steps and steps < max_steps:
+                self.step(check_every)
+                steps += check_every
+                now = self.temperature < kernels.FREEZING_TEMP
+                still = still + check_every if np.array_equal(now, frozen) else 0
+                frozen = now
+            settled = self.temperature.copy()
+            iterations.append(self.equilibrate(tol, max_iter))
+            if np.array_equal(self.temperature < kernels.FREEZING_TEMP, frozen):
+                return iterations
+            self.temperature[:] = settled
+            if steps >= max_steps:
+                return iterations
+            settle_steps *= 2
+
+    def interpolate_to(self, grid, **overrides):
+        """A new model on grid with the same parameters, starting from this model's interpolated state
+        """
+        params = dict(
+            solar_const=self.solar_const,
+            diffusion_coeff=self.diffusion_coeff,
+            windspeed=self.windspeed,
+            stefan_boltzmann=self.stepper.stefan_boltzmann,
+            dt=self.stepper.dt,
+            dtype=self.stepper.dtype,
+            num_bands=self.num_bands,
+            tol=self.stepper.tol,
+            max_substeps=self.stepper.max_substeps,
+            alt_vector=self.grid.interpolate(self.altitude, grid),
+            temp_vector=self.grid.interpolate(self.temperature, grid),
+        )
+        params.update(overrides)
+        return EnergyBalanceModel(grid, **params)
 
 
 if __name__ == "__main__":
     pygame.init()
     pygame.font.init()
-    size = width, height = NUM_COLS*TILE_WIDTH, NUM_ROWS*TILE_WIDTH
+    grid = GRID
+    size = width, height = grid.screen_size
     screen = pygame.display.set_mode(size)
 
     print("Initializing font...")
@@ -235,16 +568,19 @@ if __name__ == "__main__":
     basicfont.set_bold(False)
 
     running = True
+    recorder = None
+    timer = PhaseTimer()
+    show_profile = False
+    edited_tiles = set()  # tiles whose altitude changed since the last step
 
-    print('Initializing state vectors...')
-    alt_vector = np.zeros(NUM_TILES)
-    temp_vector = 280 * np.ones(NUM_TILES)
-    sol_vector = construct_insolation_matrix()
-    print('State vectors initialized! Initializing diffusion matrix...')
-    diffusion_matrix = construct_diffusion_matrix(0.5)
-    print('Diffusion matrix initialized! Initializing transprot matrix...')
-    transport_matrix = construct_transport_matrix(0.05)
-    print('Transport matrix initialized!')
+    print('Initializing model...')
+    model = EnergyBalanceModel(grid, diffusion_coeff=0.5, windspeed=0.05, dtype=np.float32, tol=RADIATIVE_TOL)
+    stepper = model.stepper
+    alt_vector = model.altitude
+    temp_vector = model.temperature
+    diffusion_matrix = model.diffusion_matrix
+    transport_matrix = model.transport_matrix
+    print('Model initialized!')
 
 
     print('Diffusion matrix:')
@@ -253,23 +589,26 @@ if __name__ == "__main__":
     print(transport_matrix)
 
     while True:
-        dt = 0.001
         start_time = current_time_millis()
+        timer.start_tick()
         for event in pygame.event.get():
-            if event.type == pygame.QUIT: sys.exit()
+            if event.type == pygame.QUIT:
+                if recorder is not None: recorder.close()
+                model.close()
+                sys.exit()
             elif event.type == pygame.KEYDOWN:
                 x, y = pygame.mouse.get_pos()
-                coord_x = int(x/TILE_WIDTH)
-                coord_y = int(y/TILE_WIDTH)
+                coord_x = int(x/grid.tile_width)
+                coord_y = int(y/grid.tile_width)
                 if event.key == pygame.K_i: # inspect
                     print("==== INSPECTION ====")
                     print("X, Y:", coord_x, coord_y)
-                    base_idx = coord_y * NUM_COLS + coord_x
-                    north_idx = (coord_y - 1) * NUM_COLS + coord_x
-                    south_idx = (coord_y + 1) * NUM_COLS + coord_x 
-                    east_idx = coord_y * NUM_COLS + (coord_x + 1) % NUM_COLS
-                    west_idx = coord_y * NUM_COLS + (coord_x - 1) % NUM_COLS
-                    draw_index(screen, base_idx, int(coord_x * TILE_WIDTH + TILE_WIDTH/2), int(coord_y * TILE_WIDTH + TILE_WIDTH / 2), basicfont)
+                    base_idx = coord_y * grid.num_cols + coord_x
+                    north_idx = (coord_y - 1) * grid.num_cols + coord_x
+                    south_idx = (coord_y + 1) * grid.num_cols + coord_x 
+                    east_idx = coord_y * grid.num_cols + (coord_x + 1) % grid.num_cols
+                    west_idx = coord_y * grid.num_cols + (coord_x - 1) % grid.num_cols
+                    draw_index(screen, base_idx, int(coord_x * grid.tile_width + grid.tile_width/2), int(coord_y * grid.tile_width + grid.tile_width / 2), basicfont)
                     print(base_idx, north_idx, south_idx, east_idx, west_idx)
                     print("Lon, lat:", lonlat(coord_x, coord_y))
                     try:
@@ -285,9 +624,9 @@ if __name__ == "__main__":
                     except:
                         print('Diffusion north')
                     try:
-                        if coord_y < NUM_COLS - 2: print("Diffusion south:", diffusion_matrix[south_idx, base_idx])
+                        if coord_y < grid.num_cols - 2: print("Diffusion south:", diffusion_matrix[south_idx, base_idx])
                     except:
-                        print('Diffusion south', coord_y, NUM_COLS)
+                        print('Diffusion south', coord_y, grid.num_cols)
                     try:
                         print("Diffusion east:", diffusion_matrix[east_idx, base_idx])
                         print("Diffusion west:", diffusion_matrix[west_idx, base_idx])
@@ -298,7 +637,7 @@ if __name__ == "__main__":
                     except:
                         print('Transport north')
                     try:
-                        if coord_y < NUM_COLS - 2: print("Transport south:", transport_matrix[south_idx, base_idx])
+                        if coord_y < grid.num_cols - 2: print("Transport south:", transport_matrix[south_idx, base_idx])
                     except:
                         print('Transport south')
                     try:
@@ -307,45 +646,82 @@ if __name__ == "__main__":
                     except:
                         print('Transport east/west')
                 if event.key == pygame.K_u: # land up
-                    current_alt = alt_vector[coord_y * NUM_COLS + coord_x]
-                    if current_alt < 10: alt_vector[coord_y * NUM_COLS + coord_x] += 1
+                    current_alt = alt_vector[coord_y * grid.num_cols + coord_x]
+                    if current_alt < 10: alt_vector[coord_y * grid.num_cols + coord_x] += 1
+                    edited_tiles.add(coord_y * grid.num_cols + coord_x)
                 if event.key == pygame.K_d: # land down
-                    current_alt = alt_vector[coord_y * NUM_COLS + coord_x]
-                    if current_alt > -10: alt_vector[coord_y * NUM_COLS + coord_x] -= 1
+                    current_alt = alt_vector[coord_y * grid.num_cols + coord_x]
+                    if current_alt > -10: alt_vector[coord_y * grid.num_cols + coord_x] -= 1
+                    edited_tiles.add(coord_y * grid.num_cols + coord_x)
                 if event.key == pygame.K_h: # temperature injection
-                    temp_vector[coord_y * NUM_COLS + coord_x] += 750
+                    temp_vector[coord_y * grid.num_cols + coord_x] += 750
                 if event.key == pygame.K_c: # temperature injection
-                    temp_vector[coord_y * NUM_COLS + coord_x] = 0
+                    temp_vector[coord_y * grid.num_cols + coord_x] = 0
                 if event.key == pygame.K_r: # reset temperature
-                    temp_vector = np.ones(NUM_TILES)
+                    temp_vector[:] = 1
+                if event.key == pygame.K_q: # jump to equilibrium temperature
+                    print('Spin-up Newton iterations per solve:', model.spin_up())
                 if event.key == pygame.K_1: # draw altitude
                     CURRENT_DRAW = 'alt'
                 if event.key == pygame.K_2: # draw temperature
                     CURRENT_DRAW = 'temp'
 
+                if event.key == pygame.K_s: # save state
+                    save_state(altitude=alt_vector, temperature=temp_vector,
+                               albedo=albedoize(alt_vector, temp_vector))
+                if event.key == pygame.K_l: # load state
+                    try:
+                        state = load_state(names=['altitude', 'temperature'])
+                    except (FileNotFoundError, ValueError) as err:
+                        print('Could not load state:', err)
+                    else:
+                        alt_vector[:] = state['altitude']
+                        temp_vector[:] = state['temperature']
+                        stepper.set_altitude(alt_vector)
+                if event.key == pygame.K_v: # start/stop recording
+                    if recorder is None:
+                        recorder = Recorder('energy_balance.gif', temperature_frame, stride=RECORD_STRIDE)
+                    else:
+                        recorder.close()
+                        recorder = None
+                if event.key == pygame.K_o: # per-phase profile overlay
+                    show_profile = not show_profile
+                if event.key == pygame.K_e: # export profile trace
+                    timer.export('profile.json', note=PROFILE_NOTE)
                 if event.key == pygame.K_p: # pause
                     running = not running
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 x, y = pygame.mouse.get_pos()
-                coord_x = int(x/TILE_WIDTH)
-                coord_y = int(y/TILE_WIDTH)
+                coord_x = int(x/grid.tile_width)
+                coord_y = int(y/grid.tile_width)
                 if event.button == 1:
-                    alt_vector[coord_y * NUM_COLS + coord_x] += 1
+                    alt_vector[coord_y * grid.num_cols + coord_x] += 1
                 else:
-                    alt_vector[coord_y * NUM_COLS + coord_x] -= 1
+                    alt_vector[coord_y * grid.num_cols + coord_x] -= 1
+                edited_tiles.add(coord_y * grid.num_cols + coord_x)
+        if edited_tiles:
+            stepper.set_altitude(alt_vector, list(edited_tiles))
+            edited_tiles.clear()
+        timer.lap('events')
         if running:
             mean_temp = np.mean(temp_vector)
             print(mean_temp)
-            albedo_vector = albedoize(alt_vector, temp_vector)
-            temp_vector = temp_vector + dt * (albedo_vector * sol_vector - np.maximum(STEFAN_BOLTZMANN * temp_vector**4, np.zeros(NUM_TILES)))
-            temp_vector = diffusion_matrix.dot(temp_vector)
-            temp_vector = transport_matrix.dot(temp_vector)
-            if CURRENT_DRAW == 'temp':
-                draw_temperature(screen, temp_vector, alpha=0.1)
+            if show_profile:
+                stepper.step_phases(timer)
             else:
-                draw_altitude(screen, alt_vector, temp_vector)
-            # draw_indices(screen, basicfont)
-            pygame.display.flip()
+                with timer.phase('step'):
+                    stepper.step()
+            if recorder is not None: recorder.record(temp_vector)
+            with timer.phase('draw'):
+                if CURRENT_DRAW == 'temp':
+                    draw_temperature(screen, temp_vector)
+                else:
+                    draw_altitude(screen, alt_vector, temp_vector)
+                # draw_indices(screen, basicfont)
+                if show_profile: draw_overlay(screen, timer, basicfont, title='unfused step_phases')
+            with timer.phase('flip'):
+                pygame.display.flip()
+            timer.end_tick()
         end_time = current_time_millis()
         duration = end_time - start_time
         time_left = max(0, LOOP_MS - duration)
@@ -0,0 +1,111 @@
+"""Per-phase timing of the interactive loop
+
+    timer = PhaseTimer()
+    timer.start_tick()
+    handle_events()
+    timer.lap('events')            # time since the tick started
+    with timer.phase('draw'):
+        draw_temperature(screen, temp_vector)
+    timer.end_tick()
+
+Each phase keeps a rolling window of its most recent durations, from which percentiles
+are reported; the most recent trace_length ticks are also kept in a trace that can be
+exported as CSV or JSON.
+"""
+import csv
+import json
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from time import perf_counter
+
+import numpy as np
+import pygame
+
+
+class PhaseTimer:
+    """Rolling per-phase timings, in seconds
+    """
+
+    def __init__(self, window=300, percentiles=(50, 95, 99), trace_length=10000):
+        self.window = window
+        self.percentiles = percentiles
+        self.samples = defaultdict(lambda: deque(maxlen=self.window))
+        self.trace = deque(maxlen=trace_length)
+        self._tick = {}
+        self._mark = perf_counter()
+
+    def _record(self, name, elapsed):
+        self._tick[name] = self._tick.get(name, 0.) + elapsed
+        self.samples[name].append(elapsed)
+        self._mark = perf_counter()
+
+    def start_tick(self):
+        self._tick = {}
+        self._mark = perf_counter()
+
+    def lap(self, name):
+        """Record the time since the tick started or the last phase ended as phase name
+        """
+        self._record(name, perf_counter() - self._mark)
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, perf_counter() - start)
+
+    def end_tick(self):
+        """Close the current tick and add it to the trace
+        """
+        self._tick['total'] = sum(self._tick.values())
+        self.samples['total'].append(self._tick['total'])
+        self.trace.append(self._tick)
+        self._tick = {}
+
+    def summary(self):
+        """{phase: {'p50': ..., 'p95': ..., ...}} over the rolling window
+        """
+        return {
+            name: {f'p{q}': float(v) for q, v in zip(self.percentiles, np.percentile(samples, self.percentiles))}
+            for name, samples in self.samples.items() if samples
+        }
+
+    def export(self, filename, note=None):
+        """Write the per-tick trace as .csv, or the trace and summary as .json
+
+        note, if given, goes into a leading '#' line of the CSV or a 'note' entry of the JSON.
+        """
+        if filename.endswith('.csv'):
+            phases = sorted({name for tick in self.trace for name in tick})
+            with open(filename, 'w', newline='') as f:
+                if note is not None:
+                    f.write(f'# {note}\n')
+                wrt = csv.writer(f, delimiter=',')
+                wrt.writerow(['tick'] + phases)
+                for i, tick in enumerate(self.trace):
+                    wrt.writerow([i] + [tick.get(name, '') for name in phases])
+        else:
+            with open(filename, 'w') as f:
+                json.dump({'note': note, 'summary': self.summary(), 'trace': list(self.trace)}, f)
+        return
+
+
+def draw_overlay(screen, timer, font, x=5, y=5, title=None):
+    """Draw a table of phase percentiles, in ms, in the corner of the screen, under title if given
+    """
+    summary = timer.summary()
+    header = 'phase'.ljust(10) + ''.join(f'p{q}'.rjust(8) for q in timer.percentiles)
+    lines = ([title] if title else []) + [header] + [
+        name.ljust(10) + ''.join(f'{1000 * stats[f"p{q}"]:8.2f}' for q in timer.percentiles)
+        for name, stats in summary.items()
+    ]
+    surfaces = [font.render(line, True, (255, 255, 255)) for line in lines]
+    width = max(s.get_width() for s in surfaces)
+    height = sum(s.get_height() for s in surfaces)
+    pygame.draw.rect(screen, (0, 0, 0), (x - 2, y - 2, width + 4, height + 4))
+    for surface in surfaces:
+        screen.blit(surface, (x, y))
+        y += surface.get_height()
+    return
@@ -0,0 +1,51 @@
+"""Vectorized rendering of tile grids
+
+State vectors are mapped through precomputed lookup tables into an (rows, cols, 3) RGB array,
+which is scaled onto the screen with a single surfarray blit.
+"""
+import numpy as np
+import pygame
+from matplotlib import cm
+
+
+def colormap_lut(name, size=256):
+    """RGB lookup table (size, 3) of uint8 for a matplotlib colormap
+    """
+    cmap = cm.get_cmap(name)
+    return (255 * cmap(np.linspace(0, 1, size))[:, :3]).astype(np.uint8)
+
+HOT_LUT = colormap_lut('hot')
+
+OCEAN_COLOR = np.array([135, 206, 235], dtype=np.uint8)
+ICE_COLOR = np.array([245, 245, 245], dtype=np.uint8)
+LAND_COLOR = np.array([139, 69, 19])
+
+
+def temperature_rgb(temp_vector, num_rows, num_cols, lut=HOT_LUT, max_temp=1000):
+    """Map temperatures to colors; anything at or above max_temp is drawn white
+    """
+    temp_pct = np.clip(np.asarray(temp_vector) / max_temp, 0, 1)
+    lut_idx = np.minimum((temp_pct * len(lut)).astype(np.intp), len(lut) - 1)
+    rgb = lut[lut_idx]
+    rgb[temp_pct >= 1] = 255
+    return rgb.reshape(num_rows, num_cols, 3)
+
+
+def altitude_rgb(alt_vector, frozen, num_rows, num_cols):
+    """Map altitudes to colors: ice where frozen, open ocean below sea level, shaded brown above
+    """
+    alt_vector = np.asarray(alt_vector)
+    alt_pct = 1 - np.clip(alt_vector / 10, 0, 1)
+    rgb = (alt_pct[:, None] * LAND_COLOR).astype(np.uint8)
+    rgb[alt_vector <= 0] = OCEAN_COLOR
+    rgb[frozen] = ICE_COLOR
+    return rgb.reshape(num_rows, num_cols, 3)
+
+
+def blit_grid(screen, rgb):
+    """Scale an (rows, cols, 3) RGB array to fill the screen and draw it
+    """
+    # surfarray is indexed (x, y), i.e. (cols, rows)
+    surface = pygame.surfarray.make_surface(rgb.swapaxes(0, 1))
+    screen.blit(pygame.transform.scale(surface, screen.get_size()), (0, 0))
+    return
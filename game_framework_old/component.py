@@ -2,6 +2,7 @@
 """
 
 from abc import ABC, abstractmethod
+from typing import Optional, Tuple
 
 from .types import Event
 from .queue import Queue
@@ -23,6 +24,9 @@ class QueueComponent:
 
 class AbstractEventComponent(ABC, QueueComponent):
 
+    # event types to receive from the EventHandler; None receives every event
+    event_types: Optional[Tuple[str, ...]] = None
+
     @abstractmethod
     def handle_event(self, event: Event) -> None:
         """Handle an event
@@ -1,20 +1,34 @@
 """The Event Handler processes events and distributes them to event components.
 """
-from typing import List
+from collections import defaultdict
+from typing import Dict, List, Optional
+import asyncio
+import time
 
 from .types import Event
 from .queue import Queue
-from .abstract_event_component import AbstractEventComponent
+from .component import AbstractEventComponent
 
 class EventHandler:
     """Contains infra to: dequeue and distribute events to registered event components
+
+    Components receive only the event types they subscribe to; components that subscribe
+    to nothing in particular (event_types is None) receive every event. When the queue is
+    empty, run() sleeps for idle_interval seconds rather than spinning.
     """
 
     queue: Queue
     components: List[AbstractEventComponent]
+    subscriptions: Dict[str, List[AbstractEventComponent]]
+    catch_all: List[AbstractEventComponent]
+    idle_interval: float
 
-    def __init__(self, queue: Queue):
+    def __init__(self, queue: Queue, idle_interval: float = 0.001):
         self.queue = queue
+        self.idle_interval = idle_interval
+        self.components = []
+        self.subscriptions = defaultdict(list)
+        self.catch_all = []
 
     def register_event_component(
         self,
@@ -22,11 +36,44 @@ class EventHandler:
     ) -> None:
         self.components.append(component)
         component.register_queue(self.queue)
+        if component.event_types is None:
+            self.catch_all.append(component)
+        else:
+            for event_type in component.event_types:
+                self.subscriptions[event_type].append(component)
+        return
+
+    def dispatch(self, event: Event) -> None:
+        for component in self.subscriptions.get(event.event_type, ()):
+            component.handle_event(event)
+        for component in self.catch_all:
+            component.handle_event(event)
         return
 
-    def run(self):
+    def drain(self, max_events: Optional[int] = None) -> int:
+        """Dispatch up to max_events queued events; returns how many were dispatched
+        """
+        events = self.queue.drain(max_events)
+        for event in events:
+            self.dispatch(event)
+        return len(events)
+
+    def run(self, max_events: Optional[int] = None):
         while True:
-            next_event = self.queue.dequeue()
-            for component in self.components:
-                component.handle_event(next_event)
+            if not self.drain(max_events):
+                time.sleep(self.idle_interval)
         return
+
+
+class AsyncEventHandler(EventHandler):
+    """EventHandler driven by an asyncio loop
+
+    run() is a coroutine that dispatches queued events in batches and yields to the loop
+    between batches, so components can run work in executors (see impl.state) and other
+    coroutines, such as GameClock.run_async, share the thread.
+    """
+
+    async def run(self, max_events: Optional[int] = 64):
+        while True:
+            dispatched = self.drain(max_events)
+            await asyncio.sleep(0 if dispatched else self.idle_interval)
@@ -1,31 +1,99 @@
 """Game clock - places regular update events on the queue
+
+Physics runs on a fixed timestep: wall-clock time accumulates as lag, and one
+PHYSICS_TICK is emitted per timestep owed, up to max_catch_up per frame (the rest is
+dropped rather than spiralling). DRAW_TICK events follow their own interval and carry
+the fraction of a timestep left in the accumulator, for interpolating the drawn state.
+Between deadlines the clock sleeps instead of spinning. While stopped it keeps emitting
+DRAW_TICKs, so the UI still polls input, but no PHYSICS_TICKs.
 """
+import asyncio
 import time
+from dataclasses import dataclass
+
+from ..types import Event
+from ..component import AbstractEventComponent
+
+
+@dataclass
+class ClockMetrics:
+    """Running clock statistics, in seconds
+    """
+    frame_time: float = 0.0    # time between the last two DRAW_TICKs
+    lag: float = 0.0           # simulation time owed but not yet ticked
+    physics_ticks: int = 0
+    draw_ticks: int = 0
+    dropped_ticks: int = 0     # ticks skipped because of the catch-up cap
 
-from src.types import Event
-from src.component import QueueComponent
 
 class GameClock(AbstractEventComponent):
 
-    frame_time: int
+    event_types = ("START", "STOP")
+
+    physics_dt: float
+    draw_interval: float
+    max_catch_up: int
     running: bool
+    metrics: ClockMetrics
+
+    def __init__(self, physics_dt: float = 1 / 60, draw_interval: float = 1 / 30, max_catch_up: int = 5):
+        super().__init__(name="GameClock")
+        self.physics_dt = physics_dt
+        self.draw_interval = draw_interval
+        self.max_catch_up = max_catch_up
+        self.running = False
+        self.metrics = ClockMetrics()
+        self._reset(time.monotonic())
+
+    def _reset(self, now: float) -> None:
+        self._last = now
+        self._last_draw = now
+        self._next_draw = now
+        self.metrics.lag = 0.0
+
+    def advance(self, now: float = None) -> float:
+        """Emit the ticks due at monotonic time now; returns seconds until the next deadline
+        """
+        if now is None:
+            now = time.monotonic()
+        metrics = self.metrics
+        # while paused no simulation time is owed, but drawing (and input polling) goes on
+        metrics.lag = metrics.lag + now - self._last if self.running else 0.0
+        self._last = now
+
+        due = int(metrics.lag // self.physics_dt)
+        if due > self.max_catch_up:
+            metrics.dropped_ticks += due - self.max_catch_up
+            metrics.lag -= (due - self.max_catch_up) * self.physics_dt
+            due = self.max_catch_up
+        for _ in range(due):
+            self.queue.enqueue(Event(event_type="PHYSICS_TICK", data=self.physics_dt))
+        metrics.lag -= due * self.physics_dt
+        metrics.physics_ticks += due
+
+        if now >= self._next_draw:
+            self.queue.enqueue(Event(event_type="DRAW_TICK", data=metrics.lag / self.physics_dt))
+            metrics.draw_ticks += 1
+            metrics.frame_time = now - self._last_draw
+            self._last_draw = now
+            self._next_draw += self.draw_interval
+            if self._next_draw < now:  # fell behind; don't try to draw the missed frames
+                self._next_draw = now + self.draw_interval
+        if not self.running:
+            return max(0.0, self._next_draw - now)
+        return max(0.0, min(self.physics_dt - metrics.lag, self._next_draw - now))
 
-    def __init__(self, frame_time: int):
-        self.frame_time = frame_time
-        super.__init__(name="GameClock")
-    
-    def clock_event(self) -> None:
-        self.queue.enqueue(Event(event_type="TICK"))
-        return
-    
     def run(self) -> None:
         while True:
-            if int(time.time() * 1000) % frame_time == 0:
-                if self.running:
-                    self.clock_event()
-    
+            time.sleep(self.advance())
+
+    async def run_async(self) -> None:
+        while True:
+            await asyncio.sleep(self.advance())
+
     def handle_event(self, event: Event) -> None:
         if event.event_type == "START":
+            self._reset(time.monotonic())
             self.running = True
         if event.event_type == "STOP":
-            self.running = False
\ No newline at end of file
+            self.running = False
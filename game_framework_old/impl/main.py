@@ -0,0 +1,115 @@
+"""Energy-balance model from deprecated/main.py on the asyncio event framework
+
+The clock, the event handler and the pygame UI share the asyncio loop; the model steps
+in a worker thread (SimulationComponent) and the UI draws the latest published snapshot,
+so input stays responsive however long a step takes.
+
+    python -m game_framework_old.impl.main
+"""
+import asyncio
+import os
+import sys
+
+import numpy as np
+import pygame
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "deprecated"))
+from main import (  # noqa: E402
+    GRID, EnergyBalanceModel, EnergyBalanceStepper, draw_temperature, draw_altitude,
+)
+
+from ..types import Event
+from ..queue import Queue
+from ..component import AbstractEventComponent
+from ..event_handler import AsyncEventHandler
+from .clock import GameClock
+from .state import SimulationComponent
+
+
+class GridUI(AbstractEventComponent):
+    """Polls pygame input and draws the latest snapshot on every DRAW_TICK
+
+    Drawing runs on the event loop thread while the simulation steps on a worker, so it
+    only uses the serial kernels (see draw_altitude).
+    """
+
+    event_types = ("DRAW_TICK",)
+
+    def __init__(self, screen, simulation: SimulationComponent, stepper: EnergyBalanceStepper, grid=GRID):
+        super().__init__(name="GridUI")
+        self.screen = screen
+        self.grid = grid
+        self.simulation = simulation
+        self.stepper = stepper
+        self.current_draw = "alt"
+        self.running = True
+
+    def _tile(self) -> int:
+        x, y = pygame.mouse.get_pos()
+        return self.grid.index(int(y / self.grid.tile_width), int(x / self.grid.tile_width))
+
+    def _edit_altitude(self, idx: int, delta: int) -> None:
+        def edit():
+            self.stepper.altitude[idx] = np.clip(self.stepper.altitude[idx] + delta, -10, 10)
+            self.stepper.set_altitude(self.stepper.altitude, [idx])
+        self.simulation.submit(edit)
+
+    def _heat(self, idx: int) -> None:
+        def edit():
+            self.stepper.temperature[idx] += 750
+        self.simulation.submit(edit)
+
+    def handle_event(self, event: Event) -> None:
+        for pg_event in pygame.event.get():
+            if pg_event.type == pygame.QUIT:
+                sys.exit()
+            elif pg_event.type == pygame.KEYDOWN:
+                if pg_event.key == pygame.K_u:
+                    self._edit_altitude(self._tile(), 1)
+                if pg_event.key == pygame.K_d:
+                    self._edit_altitude(self._tile(), -1)
+                if pg_event.key == pygame.K_h:
+                    self._heat(self._tile())
+                if pg_event.key == pygame.K_1:
+                    self.current_draw = "alt"
+                if pg_event.key == pygame.K_2:
+                    self.current_draw = "temp"
+                if pg_event.key == pygame.K_p:
+                    self.running = not self.running
+                    self.add_event(Event(event_type="START" if self.running else "STOP"))
+            elif pg_event.type == pygame.MOUSEBUTTONDOWN:
+                self._edit_altitude(self._tile(), 1 if pg_event.button == 1 else -1)
+        snapshot = self.simulation.latest
+        if snapshot is None:
+            return
+        alt_vector, temp_vector = snapshot.state
+        if self.current_draw == "temp":
+            draw_temperature(self.screen, temp_vector, self.grid)
+        else:
+            draw_altitude(self.screen, alt_vector, temp_vector, self.grid)
+        pygame.display.flip()
+
+
+async def main(physics_dt: float = 1 / 60, draw_interval: float = 1 / 30, grid=GRID):
+    pygame.init()
+    screen = pygame.display.set_mode(grid.screen_size)
+
+    stepper = EnergyBalanceModel(grid, diffusion_coeff=0.5, windspeed=0.05).stepper
+
+    queue = Queue("events")
+    handler = AsyncEventHandler(queue)
+    clock = GameClock(physics_dt=physics_dt, draw_interval=draw_interval)
+    simulation = SimulationComponent(
+        step=stepper.step,
+        snapshot=lambda: (stepper.altitude.copy(), stepper.temperature.copy()),
+    )
+    ui = GridUI(screen, simulation, stepper, grid)
+    for component in (clock, simulation, ui):
+        handler.register_event_component(component)
+
+    queue.enqueue(Event(event_type="START"))
+    await asyncio.gather(clock.run_async(), handler.run())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""Simulation component - steps a model off the event loop thread and publishes snapshots
+
+Each PHYSICS_TICK is counted; whenever no step is in flight, all ticks counted so far are
+handed to a worker as one batched step. When the worker finishes, a copy of the state is
+published as the latest Snapshot and as a SNAPSHOT event, so the UI always draws the newest
+completed state without waiting on the simulation.
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from time import monotonic
+from typing import Any, Callable, Deque, Optional
+
+from ..types import Event
+from ..component import AbstractEventComponent
+
+
+@dataclass
+class Snapshot:
+    """A completed simulation state
+    """
+    steps: int
+    time: float
+    state: Any
+
+
+class SimulationComponent(AbstractEventComponent):
+
+    event_types = ("PHYSICS_TICK",)
+
+    step: Callable[[int], Any]
+    snapshot: Callable[[], Any]
+    executor: Executor
+    latest: Optional[Snapshot]
+
+    def __init__(
+        self,
+        step: Callable[[int], Any],
+        snapshot: Callable[[], Any],
+        executor: Optional[Executor] = None,
+        name: str = "Simulation",
+    ):
+        """step(n_steps) advances the model; snapshot() returns a copy of its state
+        """
+        super().__init__(name=name)
+        self.step = step
+        self.snapshot = snapshot
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=1)
+        self.latest = None
+        self.steps = 0
+        self._pending = 0
+        self._in_flight = None
+        self._edits: Deque[Callable[[], None]] = deque()
+
+    def submit(self, edit: Callable[[], None]) -> None:
+        """Apply edit to the model on the worker, between steps
+        """
+        self._edits.append(edit)
+
+    def handle_event(self, event: Event) -> None:
+        if event.event_type == "PHYSICS_TICK":
+            self._pending += 1
+            self._launch()
+
+    def _launch(self) -> None:
+        if self._in_flight is not None or not self._pending:
+            return
+        n_steps, self._pending = self._pending, 0
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self._work, n_steps)
+        future.add_done_callback(lambda f: self._publish(f, n_steps))
+        self._in_flight = future
+
+    def _work(self, n_steps: int) -> Any:
+        while self._edits:
+            self._edits.popleft()()
+        self.step(n_steps)
+        return self.snapshot()
+
+    def _publish(self, future: "asyncio.Future", n_steps: int) -> None:
+        self._in_flight = None
+        self.steps += n_steps
+        self.latest = Snapshot(steps=self.steps, time=monotonic(), state=future.result())
+        self.add_event(Event(event_type="SNAPSHOT", data=self.latest))
+        self._launch()
@@ -1,18 +1,75 @@
+"""Event queues: a FIFO queue and a priority queue for timed events
+"""
+from collections import deque
+from time import monotonic
+from typing import Deque, List, Optional, Tuple
+import heapq
+import itertools
+
+from .types import Event
+
 
 class Queue:
-    """Wrapper for a list that gives fifo functionality
+    """Wrapper for a deque that gives fifo functionality
     """
 
     name: str
-    queue: List[Event]
+    queue: Deque[Event]
 
     def __init__(self, name: str) -> None:
         self.name = name
-        self.queue = []
+        self.queue = deque()
         return
-    
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
     def enqueue(self, event: Event) -> None:
-        queue.append(event)
-    
+        self.queue.append(event)
+
+    def dequeue(self) -> Event:
+        return self.queue.popleft()
+
+    def drain(self, max_events: Optional[int] = None) -> List[Event]:
+        """Dequeue up to max_events events (all of them if None)
+        """
+        count = len(self.queue) if max_events is None else min(max_events, len(self.queue))
+        return [self.queue.popleft() for _ in range(count)]
+
+
+class TimedQueue(Queue):
+    """Priority queue of events ordered by due time (monotonic seconds)
+
+    Events due at the same time dequeue in the order they were enqueued.
+    """
+
+    queue: List[Tuple[float, int, Event]]
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.queue = []
+        self._counter = itertools.count()
+        return
+
+    def enqueue(self, event: Event, due: Optional[float] = None) -> None:
+        """Schedule event at monotonic time due, or immediately if None
+        """
+        if due is None:
+            due = monotonic()
+        heapq.heappush(self.queue, (due, next(self._counter), event))
+
     def dequeue(self) -> Event:
-        return queue.pop(0)
+        return heapq.heappop(self.queue)[2]
+
+    def next_due(self) -> Optional[float]:
+        return self.queue[0][0] if self.queue else None
+
+    def drain(self, max_events: Optional[int] = None, now: Optional[float] = None) -> List[Event]:
+        """Dequeue up to max_events events that are due by now (the current time if None)
+        """
+        if now is None:
+            now = monotonic()
+        events = []
+        while self.queue and self.queue[0][0] <= now and (max_events is None or len(events) < max_events):
+            events.append(heapq.heappop(self.queue)[2])
+        return events
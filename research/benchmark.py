@@ -0,0 +1,200 @@
+"""Benchmarks for operator assembly, time stepping and rendering across resolutions
+
+Sweeps the lat/lon grid size of the energy-balance model (deprecated/main.py) and the
+maximum triangle area of the finite element mesh, timing matrix construction, per-step
+cost and frame rendering, and recording peak traced memory. Results are written as JSON
+tagged with the current git commit, so runs from different commits can be compared.
+
+    python benchmark.py --rows 30 60 120 --areas 0.001 0.0001 --output results.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import triangle as tr
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "deprecated"))
+
+from core import Geometry2D
+from hydrology import HydrologyModel
+import kernels
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results")
+
+
+def measure(fn, *args, **kwargs):
+    """Run fn once; returns (result, seconds, peak traced bytes)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench_energy_balance(num_rows, n_steps=200, n_frames=20):
+    import pygame
+    from main import (
+        construct_diffusion_matrix, construct_transport_matrix,
+        construct_insolation_vector, EnergyBalanceStepper,
+    )
+    from grid import Grid
+    from render import temperature_rgb, blit_grid
+
+    grid = Grid(num_rows)
+    num_cols, num_tiles = grid.num_cols, grid.num_tiles
+    diffusion, t_diffusion, m_diffusion = measure(construct_diffusion_matrix, 0.5, grid)
+    transport, t_transport, m_transport = measure(construct_transport_matrix, 0.05, grid)
+    stepper, t_stepper, m_stepper = measure(
+        EnergyBalanceStepper, diffusion, transport, construct_insolation_vector(grid=grid),
+        np.zeros(num_tiles), 280 * np.ones(num_tiles),
+    )
+    stepper.step()  # compile
+    _, t_steps, m_steps = measure(stepper.step, n_steps)
+
+    screen = pygame.Surface(grid.screen_size)
+    blit_grid(screen, temperature_rgb(stepper.temperature, num_rows, num_cols))
+    start = time.perf_counter()
+    for _ in range(n_frames):
+        blit_grid(screen, temperature_rgb(stepper.temperature, num_rows, num_cols))
+    t_frame = (time.perf_counter() - start) / n_frames
+
+    return {
+        "num_rows": num_rows,
+        "num_cols": num_cols,
+        "num_tiles": num_tiles,
+        "diffusion_matrix_s": t_diffusion,
+        "transport_matrix_s": t_transport,
+        "stepper_setup_s": t_stepper,
+        "step_s": t_steps / n_steps,
+        "steps_per_s": n_steps / t_steps,
+        "frame_render_s": t_frame,
+        "peak_memory_bytes": max(m_diffusion, m_transport, m_stepper, m_steps),
+    }
+
+
+def check_precision(num_rows, n_steps=2000, dtype=np.float32):
+    """Step the energy-balance model in dtype and in float64 from the same state; compare
+
+    Starts from a mixed land/ocean world at 280 K with one tile heated by 750 K (the h key),
+    so the run covers the warm-up transient as well as the approach to equilibrium.
+    """
+    from main import EnergyBalanceModel
+    from grid import Grid
+
+    grid = Grid(num_rows)
+    rng = np.random.default_rng(0)
+    alt_vector = np.where(rng.random(grid.num_tiles) < 0.3, 1., -1.)
+    temp_vector = 280 * np.ones(grid.num_tiles)
+    temp_vector[grid.num_tiles // 2] += 750
+    results = {"num_rows": num_rows, "n_steps": n_steps, "dtype": np.dtype(dtype).name}
+    temperatures = {}
+    for name, precision in (("reference", np.float64), ("reduced", dtype)):
+        model = EnergyBalanceModel(grid, alt_vector=alt_vector, temp_vector=temp_vector, dtype=precision)
+        model.step()  # compile
+        model.temperature[:] = temp_vector
+        _, elapsed, _ = measure(model.step, n_steps)
+        temperatures[name] = model.temperature.astype(np.float64)
+        results[f"{name}_step_s"] = elapsed / n_steps
+        results[f"{name}_bytes_per_step"] = int(
+            model.stepper.operator.data.nbytes + model.stepper.operator.indices.nbytes
+            + model.stepper.operator.indptr.nbytes + 5 * model.temperature.nbytes)
+    error = np.abs(temperatures["reduced"] - temperatures["reference"])
+    results["max_abs_error_K"] = float(error.max())
+    results["max_rel_error"] = float(np.max(error / np.abs(temperatures["reference"])))
+    results["mean_temp_error_K"] = float(abs(temperatures["reduced"].mean() - temperatures["reference"].mean()))
+    return results
+
+
+def bench_mesh(max_area, n_steps=20):
+    pslg = {"vertices": np.array([[0, 0], [1, 0], [1, 1], [0, 1]])}
+    tri, t_mesh, m_mesh = measure(tr.triangulate, pslg, f"qa{max_area}")
+    geometry = Geometry2D.from_triangulation(tri)
+
+    def assemble():
+        geometry.stiffness_matrix()
+        geometry.mass_matrix()
+        geometry.gradient_matrix()
+        geometry.divergence_matrix()
+    _, t_assembly, m_assembly = measure(assemble)
+
+    n = geometry.num_vertices
+    x, y = geometry.vertices[:, 0], geometry.vertices[:, 1]
+    height = 1 + y - 0.2 * np.sin(5 * x) ** 2
+    model = HydrologyModel(
+        geometry, height, 0.4 * height, 1e-3 * np.ones(n), np.zeros(n), dt=0.1,
+        outflow=1.0 * (tri["vertex_markers"].ravel() == 1),
+    )
+    dummy = np.zeros(1)
+    kernels.exchange(dummy, dummy.copy(), dummy, dummy, dummy, model.dt)  # compile
+    _, t_factor, m_factor = measure(model.step)
+    _, t_steps, m_steps = measure(model.run, n_steps)
+
+    return {
+        "max_area": max_area,
+        "num_vertices": n,
+        "num_faces": geometry.num_faces,
+        "triangulate_s": t_mesh,
+        "assembly_s": t_assembly,
+        "hydrology_first_step_s": t_factor,
+        "hydrology_step_s": t_steps / n_steps,
+        "hydrology_steps_per_s": n_steps / t_steps,
+        "peak_memory_bytes": max(m_mesh, m_assembly, m_factor, m_steps),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(rows=(30, 60, 120), areas=(0.001, 0.0001), n_steps=200):
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "energy_balance": [],
+        "precision": [],
+        "mesh": [],
+    }
+    for num_rows in rows:
+        results["energy_balance"].append(bench_energy_balance(num_rows, n_steps=n_steps))
+        print(results["energy_balance"][-1])
+        results["precision"].append(check_precision(num_rows))
+        print(results["precision"][-1])
+    for max_area in areas:
+        results["mesh"].append(bench_mesh(max_area))
+        print(results["mesh"][-1])
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[30, 60, 120])
+    parser.add_argument("--areas", type=float, nargs="+", default=[0.001, 0.0001])
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--output", default=None,
+                        help="JSON file to write; defaults to benchmark_results/<commit>.json")
+    args = parser.parse_args()
+
+    results = run(args.rows, args.areas, args.steps)
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{results['commit'] or 'unknown'}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=1)
+    print("Results written to", output)
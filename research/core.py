@@ -1,17 +1,299 @@
 """Core classes for: triangulations and assembly of finite element matrices
 """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import cached_property
+import hashlib
+import json
+import os
+import shutil
 import numpy as np
+from scipy import sparse
 import triangle as tr
 
 
+MESH_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mesh_cache")
+MESH_CACHE_VERSION = 2
+
+
+def pslg_hash(pslg, switches):
+    """Content hash of a planar straight line graph (triangle's input dict) and triangle switches
+    """
+    digest = hashlib.sha256(f"v{MESH_CACHE_VERSION}:{switches}".encode())
+    for key in sorted(pslg):
+        arr = np.ascontiguousarray(pslg[key])
+        digest.update(f"{key}:{arr.dtype.str}:{arr.shape}".encode())
+        digest.update(arr.tobytes())
+    return digest.hexdigest()
+
+
 # Two-dimensional Euclidean geometries
 
 @dataclass
 class Geometry2D:
-    
-    vertices: np.array
-    faces: np.array
-    
-    
\ No newline at end of file
+    """Triangulated planar domain with first order (piecewise linear) finite elements
+
+    Per-face quantities are computed for all faces at once as arrays, and the assembled
+    operators are sparse CSR matrices, memoized after their first assembly.
+    """
+
+    vertices: np.array  # shape = (num_vertices, 2)
+    faces: np.array     # shape = (num_faces, 3), vertex indices
+    _operators: dict = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    # arrays and operators written to / read from the mesh cache, alongside vertices and faces
+    _cached_arrays = ("face_areas", "face_centroids", "face_neighbors", "corner_angles", "edges")
+    _cached_operators = {
+        "vertex_faces": "vertex_face_matrix",
+        "vertex_mean": "vertex_mean_matrix",
+        "stiffness": "stiffness_matrix",
+        "mass": "mass_matrix",
+        "gradient": "gradient_matrix",
+        "divergence": "divergence_matrix",
+    }
+
+    @classmethod
+    def from_triangulation(cls, tri):
+        """Wrap the output of triangle.triangulate
+        """
+        return cls(vertices=tri["vertices"], faces=tri["triangles"])
+
+    @classmethod
+    def triangulate(cls, pslg, switches, cache_dir=MESH_CACHE_DIR):
+        """triangle.triangulate(pslg, switches), with the mesh and its operators cached on disk
+
+        The cache entry is keyed on a hash of the input and the switches; on a hit the arrays
+        are memory-mapped instead of re-meshed and re-assembled.
+        """
+        path = os.path.join(cache_dir, pslg_hash(pslg, switches))
+        if os.path.exists(os.path.join(path, "manifest.json")):
+            return cls.load(path)
+        geometry = cls.from_triangulation(tr.triangulate(pslg, switches))
+        geometry.save(path)
+        return geometry
+
+    def save(self, path):
+        """Write the mesh, its cached arrays and all operators to a directory of .npy files
+        """
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        arrays = {"vertices": self.vertices, "faces": self.faces}
+        arrays.update((name, getattr(self, name)) for name in self._cached_arrays)
+        shapes = {}
+        for name, method in self._cached_operators.items():
+            A = getattr(self, method)()
+            shapes[name] = A.shape
+            arrays.update({f"{name}.data": A.data, f"{name}.indices": A.indices, f"{name}.indptr": A.indptr})
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(arr))
+        # the manifest is written last and marks the entry complete
+        with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+            json.dump({"arrays": sorted(arrays), "operators": shapes}, f)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        return
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Read a directory written by save(), memory-mapping the arrays by default
+        """
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in manifest["arrays"]
+        }
+        geometry = cls(vertices=arrays["vertices"], faces=arrays["faces"])
+        for name in cls._cached_arrays:
+            # pre-populate the cached_property
+            vars(geometry)[name] = arrays[name]
+        for name, shape in manifest["operators"].items():
+            geometry._operators[name] = sparse.csr_matrix(
+                (arrays[f"{name}.data"], arrays[f"{name}.indices"], arrays[f"{name}.indptr"]),
+                shape=tuple(shape),
+            )
+        return geometry
+
+    @property
+    def num_vertices(self):
+        return self.vertices.shape[0]
+
+    @property
+    def num_faces(self):
+        return self.faces.shape[0]
+
+    @cached_property
+    def _corners(self):
+        """Face corner coordinates, shape = (num_faces, 3, 2)
+        """
+        return self.vertices[self.faces]
+
+    @cached_property
+    def _signed_face_areas(self):
+        p0, p1, p2 = self._corners[:, 0], self._corners[:, 1], self._corners[:, 2]
+        u, v = p1 - p0, p2 - p0
+        return (u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]) / 2.0
+
+    @cached_property
+    def face_areas(self):
+        return np.abs(self._signed_face_areas)
+
+    @cached_property
+    def face_centroids(self):
+        """shape = (num_faces, 2)
+        """
+        return self._corners.mean(axis=1)
+
+    @cached_property
+    def face_neighbors(self):
+        """Face across the edge opposite each corner, shape = (num_faces, 3); -1 on the boundary
+        """
+        # the edge opposite corner k joins corners k+1 and k+2
+        a = np.roll(self.faces, -1, axis=1).ravel().astype(np.int64)
+        b = np.roll(self.faces, -2, axis=1).ravel().astype(np.int64)
+        key = np.minimum(a, b) * self.num_vertices + np.maximum(a, b)
+        order = np.argsort(key, kind="stable")
+        # an interior edge appears exactly twice, consecutively after sorting
+        shared = np.flatnonzero(key[order[1:]] == key[order[:-1]])
+        first, second = order[shared], order[shared + 1]
+        neighbors = np.full(3 * self.num_faces, -1, dtype=np.int64)
+        neighbors[first] = second // 3
+        neighbors[second] = first // 3
+        return neighbors.reshape(self.num_faces, 3)
+
+    @cached_property
+    def edges(self):
+        """Unique edges as sorted vertex index pairs, shape = (num_edges, 2)
+        """
+        pairs = np.concatenate([self.faces[:, [0, 1]], self.faces[:, [1, 2]], self.faces[:, [2, 0]]])
+        return np.unique(np.sort(pairs, axis=1), axis=0)
+
+    @cached_property
+    def boundary_vertices(self):
+        """Indices of the vertices on boundary edges (edges of only one face)
+        """
+        pairs = np.concatenate([self.faces[:, [0, 1]], self.faces[:, [1, 2]], self.faces[:, [2, 0]]])
+        edges, counts = np.unique(np.sort(pairs, axis=1), axis=0, return_counts=True)
+        return np.unique(edges[counts == 1])
+
+    @cached_property
+    def vertex_areas(self):
+        """Lumped mass: a third of the area of each face around a vertex
+        """
+        return np.bincount(self.faces.ravel(), np.repeat(self.face_areas / 3, 3), minlength=self.num_vertices)
+
+    @cached_property
+    def corner_angles(self):
+        """Interior angle at each face corner, shape = (num_faces, 3)
+        """
+        p = self._corners
+        u = np.roll(p, -1, axis=1) - p
+        v = np.roll(p, -2, axis=1) - p
+        cross = u[:, :, 0] * v[:, :, 1] - u[:, :, 1] * v[:, :, 0]
+        dot = np.einsum("fkd,fkd->fk", u, v)
+        return np.arctan2(np.abs(cross), dot)
+
+    def vertex_face_matrix(self):
+        """Vertex-to-face incidence, shape = (num_vertices, num_faces); row v lists the faces around v
+        """
+        if "vertex_faces" not in self._operators:
+            rows = self.faces.ravel()
+            cols = np.repeat(np.arange(self.num_faces), 3)
+            shape = (self.num_vertices, self.num_faces)
+            self._operators["vertex_faces"] = sparse.csr_matrix(
+                (np.ones(len(rows)), (rows, cols)), shape=shape)
+        return self._operators["vertex_faces"]
+
+    def vertex_mean_matrix(self):
+        """Averages face values onto vertices, weighting each face by its corner angle at the vertex
+        """
+        if "vertex_mean" not in self._operators:
+            rows = self.faces.ravel()
+            cols = np.repeat(np.arange(self.num_faces), 3)
+            angles = self.corner_angles.ravel()
+            angle_sums = np.bincount(rows, weights=angles, minlength=self.num_vertices)
+            shape = (self.num_vertices, self.num_faces)
+            self._operators["vertex_mean"] = sparse.csr_matrix(
+                (angles / angle_sums[rows], (rows, cols)), shape=shape)
+        return self._operators["vertex_mean"]
+
+    def vertex_mean(self, u):
+        """Angle-weighted vertex average of face values u, shape = (num_faces,) or (d, num_faces)
+        """
+        return self.vertex_mean_matrix().dot(np.asarray(u).T).T
+
+    def face_mean(self, u):
+        """Mean of vertex values u over each face
+        """
+        return np.asarray(u)[self.faces].mean(axis=1)
+
+    @cached_property
+    def barycentric_gradients(self):
+        """Gradient of each face's three element functions, shape = (num_faces, 3, 2)
+
+        The gradient of the element function at corner k is the opposite edge rotated
+        a quarter turn, divided by twice the signed area.
+        """
+        p = self._corners
+        # edge opposite corner k runs from corner k+1 to corner k+2
+        opposite = np.roll(p, -2, axis=1) - np.roll(p, -1, axis=1)
+        rotated = np.stack([-opposite[:, :, 1], opposite[:, :, 0]], axis=2)
+        return rotated / (2.0 * self._signed_face_areas[:, None, None])
+
+    def _assemble_vertex_matrix(self, local):
+        """Sum per-face (num_faces, 3, 3) blocks into a (num_vertices, num_vertices) matrix
+        """
+        rows = np.repeat(self.faces, 3, axis=1).ravel()
+        cols = np.tile(self.faces, (1, 3)).ravel()
+        shape = (self.num_vertices, self.num_vertices)
+        return sparse.coo_matrix((local.ravel(), (rows, cols)), shape=shape).tocsr()
+
+    def stiffness_matrix(self):
+        """K_ij = sum over faces of area * <grad phi_i, grad phi_j>
+        """
+        if "stiffness" not in self._operators:
+            g = self.barycentric_gradients
+            local = self.face_areas[:, None, None] * np.einsum("fid,fjd->fij", g, g)
+            self._operators["stiffness"] = self._assemble_vertex_matrix(local)
+        return self._operators["stiffness"]
+
+    def mass_matrix(self):
+        """L^2 inner product of the element functions: area / 6 on the diagonal, area / 12 off it
+        """
+        if "mass" not in self._operators:
+            pattern = (np.ones((3, 3)) + np.eye(3)) / 12.0
+            local = self.face_areas[:, None, None] * pattern
+            self._operators["mass"] = self._assemble_vertex_matrix(local)
+        return self._operators["mass"]
+
+    def gradient_matrix(self):
+        """Maps vertex values to the constant gradient on each face, shape = (2 * num_faces, num_vertices)
+
+        Rows [0, num_faces) hold the x components and rows [num_faces, 2 * num_faces) the y components.
+        """
+        if "gradient" not in self._operators:
+            g = self.barycentric_gradients
+            face_ind = np.arange(self.num_faces)
+            rows = np.concatenate([
+                np.repeat(face_ind, 3),
+                np.repeat(face_ind + self.num_faces, 3),
+            ])
+            cols = np.concatenate([self.faces.ravel(), self.faces.ravel()])
+            vals = np.concatenate([g[:, :, 0].ravel(), g[:, :, 1].ravel()])
+            shape = (2 * self.num_faces, self.num_vertices)
+            self._operators["gradient"] = sparse.coo_matrix((vals, (rows, cols)), shape=shape).tocsr()
+        return self._operators["gradient"]
+
+    def divergence_matrix(self):
+        """Weak divergence of face vector fields, shape = (num_vertices, 2 * num_faces)
+
+        Adjoint of the gradient with respect to the area-weighted face inner product,
+        so that divergence_matrix() @ gradient_matrix() == -stiffness_matrix().
+        """
+        if "divergence" not in self._operators:
+            areas = np.concatenate([self.face_areas, self.face_areas])
+            self._operators["divergence"] = (
+                -self.gradient_matrix().T.dot(sparse.diags(areas))
+            ).tocsr()
+        return self._operators["divergence"]
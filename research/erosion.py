@@ -0,0 +1,173 @@
+"""Fluvial erosion and sediment transport on a Geometry2D mesh
+
+Each vertex drains to its steepest downhill neighbour (its receiver), which turns the mesh
+into a drainage forest rooted at the outlets and at pits. Sorting vertices by height gives
+an order with every vertex after the vertices draining into it, so drainage area is one
+sweep down the forest. Each step then
+
+    - lowers the terrain by stream-power erosion, dh/dt = U - K A^m S, solved implicitly
+      receivers first (Braun & Willett, 2013), so dt is not limited by the steepest slope;
+    - routes the eroded material downstream, depositing a fraction G / A of the sediment
+      flux per unit area (Davy & Lague, 2009). Pits keep what reaches them up to the
+      height of their lowest neighbour, where they would spill; the rest is lost, as if
+      carried on by the overflowing lake.
+
+Only the forest sweeps are sequential; they run in kernels (compiled with numba when it is
+installed), everything else is array arithmetic over all vertices.
+"""
+
+from dataclasses import dataclass, field
+import numpy as np
+
+from core import Geometry2D
+from snapshot import SnapshotStore
+import kernels
+
+
+def steepest_descent(geometry, height, outlets=()):
+    """Receiver and distance to it for every vertex
+
+    Vertices with no lower neighbour, and the outlets, drain to themselves (distance 1).
+    """
+    n = geometry.num_vertices
+    a, b = geometry.edges[:, 0], geometry.edges[:, 1]
+    length = np.linalg.norm(geometry.vertices[a] - geometry.vertices[b], axis=1)
+    drop = (height[a] - height[b]) / length
+    # every edge in both directions, keeping the downhill ones
+    src = np.concatenate([a, b])
+    dst = np.concatenate([b, a])
+    slope = np.concatenate([drop, -drop])
+    downhill = slope > 0
+    downhill[np.isin(src, outlets)] = False
+    src, dst, slope, length = src[downhill], dst[downhill], slope[downhill], np.tile(length, 2)[downhill]
+    # steepest edge per source: last one after sorting by (source, slope)
+    order = np.lexsort((slope, src))
+    last = order[np.append(src[order][1:] != src[order][:-1], True)]
+    receivers = np.arange(n)
+    distance = np.ones(n)
+    receivers[src[last]] = dst[last]
+    distance[src[last]] = length[last]
+    return receivers, distance
+
+
+def spill_heights(geometry, height):
+    """Height of the lowest neighbour of every vertex
+    """
+    a, b = geometry.edges[:, 0], geometry.edges[:, 1]
+    spill = np.full(geometry.num_vertices, np.inf)
+    np.minimum.at(spill, a, height[b])
+    np.minimum.at(spill, b, height[a])
+    return spill
+
+
+def drainage_order(height):
+    """Vertices from highest to lowest: each comes after every vertex draining into it
+    """
+    return np.argsort(-height, kind="stable")
+
+
+def drainage_area(order, receivers, vertex_areas):
+    """Area draining through each vertex, its own included
+    """
+    return kernels.tree_accumulate(order, receivers, np.ones(len(order)), vertex_areas, np.empty(len(order)))
+
+
+@dataclass
+class ErosionModel:
+    """Terrain made of bedrock, erodible rock and sediment, eroded by the water draining over it
+
+    Rock erodes with erodibility and sediment with sediment_erodibility; bedrock does not
+    erode. Outlets (the boundary vertices by default) are fixed base levels that carry
+    sediment out of the domain.
+    """
+
+    geometry: Geometry2D
+    bedrock: np.array   # non-erodible floor
+    rock: np.array      # erodible rock thickness above bedrock
+    sediment: np.array  # sediment thickness above rock
+    uplift: float = 0.0             # rock uplift rate, scalar or per vertex
+    erodibility: float = 1e-3       # K for rock
+    sediment_erodibility: float = 1e-2
+    area_exponent: float = 0.5      # m
+    deposition: float = 1.0         # G
+    dt: float = 1.0
+    outlets: np.array = None
+    receivers: np.array = field(default=None, init=False, repr=False, compare=False)
+    area: np.array = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.outlets is None:
+            self.outlets = self.geometry.boundary_vertices
+
+    @property
+    def height(self):
+        return self.bedrock + self.rock + self.sediment
+
+    def route(self):
+        """Receivers, drainage order, distances and drainage area of the current terrain
+        """
+        height = self.height
+        receivers, distance = steepest_descent(self.geometry, height, self.outlets)
+        order = drainage_order(height)
+        self.receivers = receivers
+        self.area = drainage_area(order, receivers, self.geometry.vertex_areas)
+        return order, distance
+
+    def step(self):
+        order, distance = self.route()
+        receivers, area = self.receivers, self.area
+        cell_area = self.geometry.vertex_areas
+        drains = receivers != np.arange(len(receivers))
+        is_outlet = np.zeros(len(receivers), dtype=bool)
+        is_outlet[self.outlets] = True
+        self.rock += np.where(is_outlet, 0., self.dt * self.uplift)
+        height = self.height
+
+        # stream-power erosion, implicit in the new height
+        erodibility = np.where(self.sediment > 0, self.sediment_erodibility, self.erodibility)
+        coeff = np.where(drains, erodibility * self.dt * area**self.area_exponent / distance, 0.)
+        eroded_height = kernels.tree_implicit(order, receivers, coeff, height, np.empty(len(height)))
+        eroded = np.clip(height - eroded_height, 0, self.rock + self.sediment)
+
+        # sediment routing: flux out of v = (flux in + eroded volume) / (1 + G a / A)
+        # outlets pass everything they receive out of the domain
+        retained = np.where(is_outlet, 0., self.deposition * cell_area / area)
+        flux = kernels.tree_accumulate(order, receivers, 1 + retained, eroded * cell_area, np.empty(len(height)))
+        deposited = retained * flux / cell_area
+        deposited[is_outlet] = 0
+        pits = np.flatnonzero(~drains & ~is_outlet)
+        eroded_height = height - eroded
+        room = np.maximum(spill_heights(self.geometry, eroded_height)[pits] - eroded_height[pits], 0)
+        deposited[pits] = np.minimum((1 + retained[pits]) * flux[pits] / cell_area[pits], room)
+
+        from_sediment = np.minimum(eroded, self.sediment)
+        self.sediment += deposited - from_sediment
+        self.rock -= eroded - from_sediment
+        return
+
+    def state(self):
+        """The model's per-vertex fields, by name
+        """
+        return {"bedrock": self.bedrock, "rock": self.rock, "sediment": self.sediment}
+
+    def checkpoint(self, path, **metadata):
+        """Save the current fields to the snapshot store at path
+        """
+        SnapshotStore(path).save(self.state(), num_vertices=self.geometry.num_vertices, **metadata)
+        return
+
+    def resume(self, path):
+        fields = SnapshotStore(path).load(mmap_mode=None)
+        self.bedrock = fields["bedrock"]
+        self.rock = fields["rock"]
+        self.sediment = fields["sediment"]
+        return
+
+    def run(self, n_steps, callback=None):
+        """Advance n_steps; callback(model, step) is called after every step
+        """
+        for step in range(n_steps):
+            self.step()
+            if callback is not None:
+                callback(self, step)
+        return n_steps
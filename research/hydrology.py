@@ -0,0 +1,175 @@
+"""Surface and groundwater hydrology on a Geometry2D mesh
+
+Water flows down the gradient of its hydraulic head (water depth plus the underlying
+terrain). Each step first exchanges water between the surface, the ground and the
+atmosphere vertex by vertex, then diffuses both layers with a theta-method step
+(theta = 1 is backward Euler, theta = 0.5 is Crank-Nicolson). The sparse system matrix
+is factorized once per time step size and reused, so dt can be far larger than the
+explicit update in hydrological_model.ipynb allows.
+"""
+
+from dataclasses import dataclass, field
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg as splin
+
+from core import Geometry2D
+from snapshot import SnapshotStore
+import kernels
+
+
+@dataclass
+class HydrologyModel:
+    """Surface water and groundwater on a triangulated terrain
+    """
+
+    geometry: Geometry2D
+    height: np.array         # terrain height at each vertex
+    bedrock: np.array        # impermeable layer height; groundwater flows over it
+    precipitation: np.array  # rate per vertex
+    evaporation: np.array    # rate per vertex
+    surface_flow: float = 1.0
+    percolation: float = 0.1
+    dt: float = 1.0
+    theta: float = 1.0
+    outflow: np.array = None  # surface runoff rate out of the domain per vertex, e.g. at boundary vertices
+    surfacewater: np.array = None
+    groundwater: np.array = None
+    _solvers: dict = field(default_factory=dict, init=False, repr=False, compare=False)
+    _base_flux: dict = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        n = self.geometry.num_vertices
+        if self.surfacewater is None:
+            self.surfacewater = np.zeros(n)
+        if self.groundwater is None:
+            self.groundwater = np.zeros(n)
+        if self.outflow is None:
+            self.outflow = np.zeros(n)
+
+    @property
+    def capacity(self):
+        """Volume the soil above bedrock can hold before water returns to the surface
+        """
+        return self.height - self.bedrock
+
+    def _layer(self, layer):
+        """Coefficient, base height and sink rate of the "surface" or "ground" layer
+        """
+        if layer == "surface":
+            return self.surface_flow, self.height, self.outflow
+        return self.percolation, self.bedrock, np.zeros(self.geometry.num_vertices)
+
+    def _solver(self, layer):
+        """System operator A = coeff * K + M diag(sink) and the factorized M + theta * dt * A
+
+        Cached per (layer, dt, theta); clear _solvers after changing the coefficients or outflow.
+        """
+        key = (layer, self.dt, self.theta)
+        if key not in self._solvers:
+            coeff, _, sink = self._layer(layer)
+            M = self.geometry.mass_matrix()
+            A = (coeff * self.geometry.stiffness_matrix() + M.dot(sparse.diags(sink))).tocsr()
+            lu = splin.splu(sparse.csc_matrix(M + self.theta * self.dt * A))
+            self._solvers[key] = (A, lu)
+        return self._solvers[key]
+
+    def _flux(self, layer):
+        """coeff * K @ base, the terrain's contribution to the layer's flow
+
+        Cached per layer and kept current by edit_terrain; clear _base_flux after assigning
+        height or bedrock directly.
+        """
+        if layer not in self._base_flux:
+            coeff, base, _ = self._layer(layer)
+            self._base_flux[layer] = coeff * self.geometry.stiffness_matrix().dot(base)
+        return self._base_flux[layer]
+
+    def _diffuse(self, water, layer):
+        """One theta-method step of M dw/dt = -coeff * K (w + base) - M sink w
+        """
+        A, lu = self._solver(layer)
+        M = self.geometry.mass_matrix()
+        rhs = M.dot(water) - self.dt * ((1 - self.theta) * A.dot(water) + self._flux(layer))
+        return np.maximum(0, lu.solve(rhs))
+
+    def edit_terrain(self, vertices, height=None, bedrock=None):
+        """Set the height and/or bedrock of some (distinct) vertices
+
+        Only the stiffness columns of the edited vertices are touched to update the cached
+        terrain flux, so small edits on large meshes cost little.
+        """
+        vertices = np.asarray(vertices, dtype=np.intp)
+        K = self.geometry.stiffness_matrix()  # symmetric, so column v is row v
+        for layer, base, values in (("surface", self.height, height), ("ground", self.bedrock, bedrock)):
+            if values is None:
+                continue
+            delta = np.broadcast_to(values, vertices.shape) - base[vertices]
+            base[vertices] += delta
+            if layer in self._base_flux:
+                coeff, _, _ = self._layer(layer)
+                flux = self._base_flux[layer]
+                for v, d in zip(vertices, coeff * delta):
+                    row = slice(K.indptr[v], K.indptr[v + 1])
+                    flux[K.indices[row]] += d * K.data[row]
+        return
+
+    def state(self):
+        """The model's per-vertex fields, by name
+        """
+        return {
+            "height": self.height,
+            "bedrock": self.bedrock,
+            "surfacewater": self.surfacewater,
+            "groundwater": self.groundwater,
+        }
+
+    def checkpoint(self, path, **metadata):
+        """Save the current fields to the snapshot store at path
+        """
+        SnapshotStore(path).save(self.state(), num_vertices=self.geometry.num_vertices, **metadata)
+        return
+
+    def resume(self, path):
+        """Restore the water (and terrain) fields from a checkpoint
+        """
+        fields = SnapshotStore(path).load(mmap_mode=None)
+        self.height = fields["height"]
+        self.bedrock = fields["bedrock"]
+        self.surfacewater = fields["surfacewater"]
+        self.groundwater = fields["groundwater"]
+        self._base_flux.clear()
+        return
+
+    def exchange(self):
+        """Move water between the ground, the surface and the atmosphere at each vertex
+        """
+        kernels.exchange(self.surfacewater, self.groundwater, self.capacity,
+                         self.evaporation, self.precipitation, self.dt)
+        return
+
+    def step(self):
+        self.exchange()
+        self.surfacewater = self._diffuse(self.surfacewater, "surface")
+        self.groundwater = self._diffuse(self.groundwater, "ground")
+        return
+
+    def run(self, n_steps, tol=None, callback=None):
+        """Advance up to n_steps, stopping once the largest rate of change drops below tol
+
+        callback(model, step) is called after every step. Returns the number of steps taken.
+        """
+        for step in range(n_steps):
+            previous_surface = self.surfacewater.copy()
+            previous_ground = self.groundwater.copy()
+            self.step()
+            if callback is not None:
+                callback(self, step)
+            if tol is not None:
+                change = max(
+                    np.max(np.abs(self.surfacewater - previous_surface)),
+                    np.max(np.abs(self.groundwater - previous_ground)),
+                )
+                if change / self.dt < tol:
+                    return step + 1
+        return n_steps
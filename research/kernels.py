@@ -0,0 +1,330 @@
+"""Per-tile and per-vertex physics kernels
+
+Each kernel writes into caller-provided output buffers and fuses its arithmetic into a
+single pass, compiled with numba when it is installed. Without numba the same kernels
+fall back to NumPy expressions over the buffers.
+
+    albedo         absorbed fraction of insolation for land, open ocean and ice
+    albedo_serial  the same, serial and GIL-free, for drawing on one thread while a
+                   parallel kernel steps the model on another (numba's default
+                   threading layer aborts when two threads launch parallel kernels)
+    frozen         ice mask for ocean tiles, serial and GIL-free like albedo_serial
+    radiate        T + dt * (albedo * insolation - sigma * T^4)
+    advance        n fused steps of radiate followed by a CSR operator
+    csr_matvec     out = A @ x for a CSR matrix given as (indptr, indices, data)
+    band_step      one radiate + operator step over a band of rows and its halo, serial
+                   and GIL-free so that several bands can run on threads at once
+    radiate_adaptive, advance_adaptive, band_step_adaptive
+                   the same with the radiative term integrated by linearized-implicit
+                   sub-steps, as many per tile as its local error estimate needs
+    exchange       surface water / groundwater / atmosphere exchange
+    tree_accumulate, tree_implicit
+                   sweeps over a drainage forest (each vertex drains to one receiver),
+                   donors first or receivers first; see erosion.py
+"""
+
+import math
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg as splinalg
+
+try:
+    import numba as nb
+except ImportError:
+    nb = None
+
+HAVE_NUMBA = nb is not None
+
+FREEZING_TEMP = 280
+OCEAN_ALBEDO = 0.96
+ICE_ALBEDO = 0.1
+LAND_ALBEDO = 0.6
+
+
+# NumPy fallbacks
+
+def _albedo_numpy(alt, temp, out):
+    ocean = alt <= 0
+    out[:] = LAND_ALBEDO
+    out[ocean & (temp > FREEZING_TEMP)] = OCEAN_ALBEDO
+    out[ocean & (temp <= FREEZING_TEMP)] = ICE_ALBEDO
+    return out
+
+def _frozen_numpy(alt, temp, out):
+    np.less_equal(alt, 0, out=out)
+    out &= temp < FREEZING_TEMP
+    return out
+
+def _radiate_numpy(temp, absorbed_warm, absorbed_cold, sigma, dt, out):
+    np.copyto(out, absorbed_cold)
+    np.copyto(out, absorbed_warm, where=temp > FREEZING_TEMP)
+    radiated = np.power(temp, 4)
+    radiated *= sigma
+    np.maximum(radiated, 0, out=radiated)
+    out -= radiated
+    out *= dt
+    out += temp
+    return out
+
+def _substeps_numpy(temp, absorbed_warm, absorbed_cold, sigma, dt, tol, max_substeps):
+    """Sub-steps per tile so that each linearized-implicit radiative step stays within tol
+
+    The local error of one step of size h is estimated by its difference from an explicit
+    step, h^2 |f| J / (1 + h J) with f = a - sigma T^4 and J = 4 sigma T^3; it shrinks as
+    h^2, so n = ceil(sqrt(err(dt) / tol)) sub-steps are taken.
+    """
+    absorbed = np.where(temp > FREEZING_TEMP, absorbed_warm, absorbed_cold)
+    rate = absorbed - np.maximum(sigma * temp**4, 0)
+    jacobian = 4 * sigma * np.maximum(temp, 0)**3
+    error = dt * dt * np.abs(rate) * jacobian / (1 + dt * jacobian)
+    return np.clip(np.ceil(np.sqrt(error / tol)), 1, max_substeps).astype(np.int32)
+
+def _radiate_adaptive_numpy(temp, absorbed_warm, absorbed_cold, sigma, dt, tol, max_substeps, out, substeps):
+    substeps[:] = _substeps_numpy(temp, absorbed_warm, absorbed_cold, sigma, dt, tol, max_substeps)
+    h = dt / substeps
+    out[:] = temp
+    for k in range(substeps.max()):
+        active = substeps > k
+        t = out[active]
+        absorbed = np.where(t > FREEZING_TEMP, absorbed_warm[active], absorbed_cold[active])
+        jacobian = 4 * sigma * np.maximum(t, 0)**3
+        out[active] = t + h[active] * (absorbed - np.maximum(sigma * t**4, 0)) / (1 + h[active] * jacobian)
+    return out
+
+def _advance_adaptive_numpy(temp, buf, substeps, absorbed_warm, absorbed_cold, indptr, indices, data,
+                            sigma, dt, tol, max_substeps, n_steps):
+    A = sparse.csr_matrix((data, indices, indptr), shape=(len(temp), len(temp)))
+    for _ in range(n_steps):
+        _radiate_adaptive_numpy(temp, absorbed_warm, absorbed_cold, sigma, dt, tol, max_substeps, buf, substeps)
+        temp[:] = A.dot(buf)
+    return temp
+
+def _csr_matvec_numpy(indptr, indices, data, x, out):
+    A = sparse.csr_matrix((data, indices, indptr), shape=(len(out), len(x)))
+    out[:] = A.dot(x)
+    return out
+
+def _advance_numpy(temp, buf, absorbed_warm, absorbed_cold, indptr, indices, data, sigma, dt, n_steps):
+    A = sparse.csr_matrix((data, indices, indptr), shape=(len(temp), len(temp)))
+    for _ in range(n_steps):
+        _radiate_numpy(temp, absorbed_warm, absorbed_cold, sigma, dt, buf)
+        temp[:] = A.dot(buf)
+    return temp
+
+def _band_step_numpy(temp, out, buf, absorbed_warm, absorbed_cold, indptr, indices, data, sigma, dt):
+    _radiate_numpy(temp, absorbed_warm, absorbed_cold, sigma, dt, buf)
+    return _csr_matvec_numpy(indptr, indices, data, buf, out)
+
+def _band_step_adaptive_numpy(temp, out, buf, substeps, absorbed_warm, absorbed_cold, indptr, indices, data,
+                              sigma, dt, tol, max_substeps):
+    _radiate_adaptive_numpy(temp, absorbed_warm, absorbed_cold, sigma, dt, tol, max_substeps, buf, substeps)
+    return _csr_matvec_numpy(indptr, indices, data, buf, out)
+
+def _exchange_numpy(surfacewater, groundwater, capacity, evaporation, precipitation, dt):
+    groundwater_to_surface = np.maximum(0, groundwater - capacity)
+    surfacewater_to_ground = np.minimum(surfacewater, np.maximum(0, capacity - groundwater))
+    surfacewater += groundwater_to_surface - surfacewater_to_ground
+    surfacewater -= np.minimum(dt * evaporation, surfacewater)
+    surfacewater += dt * precipitation
+    groundwater += surfacewater_to_ground - groundwater_to_surface
+    return surfacewater, groundwater
+
+
+def _donor_matrix(receivers, values):
+    """Sparse matrix with values[d] at (receivers[d], d) for every vertex d that drains elsewhere
+    """
+    n = len(receivers)
+    donors = np.flatnonzero(receivers != np.arange(n))
+    return sparse.csr_matrix((values[donors], (receivers[donors], donors)), shape=(n, n))
+
+def _tree_accumulate_numpy(order, receivers, coeff, rhs, out):
+    A = sparse.diags(coeff) - _donor_matrix(receivers, np.ones(len(rhs)))
+    out[:] = splinalg.spsolve(A.tocsc(), rhs)
+    return out
+
+def _tree_implicit_numpy(order, receivers, coeff, rhs, out):
+    A = sparse.diags(1 + coeff) - _donor_matrix(receivers, coeff).T
+    out[:] = splinalg.spsolve(A.tocsc(), rhs)
+    return out
+
+
+# compiled kernels
+
+if HAVE_NUMBA:
+
+    @nb.njit(nogil=True, cache=True)
+    def _albedo_tile(alt, t):
+        if alt > 0:
+            return LAND_ALBEDO
+        if t > FREEZING_TEMP:
+            return OCEAN_ALBEDO
+        return ICE_ALBEDO
+
+    @nb.njit(parallel=True, nogil=True, cache=True)
+    def albedo(alt, temp, out):
+        for i in nb.prange(len(alt)):
+            out[i] = _albedo_tile(alt[i], temp[i])
+        return out
+
+    @nb.njit(nogil=True, cache=True)
+    def albedo_serial(alt, temp, out):
+        for i in range(len(alt)):
+            out[i] = _albedo_tile(alt[i], temp[i])
+        return out
+
+    @nb.njit(nogil=True, cache=True)
+    def frozen(alt, temp, out):
+        for i in range(len(alt)):
+            out[i] = alt[i] <= 0 and temp[i] < FREEZING_TEMP
+        return out
+
+    @nb.njit(parallel=True, nogil=True, cache=True)
+    def radiate(temp, absorbed_warm, absorbed_cold, sigma, dt, out):
+        for i in nb.prange(len(temp)):
+            t = temp[i]
+            absorbed = absorbed_warm[i] if t > FREEZING_TEMP else absorbed_cold[i]
+            out[i] = t + dt * (absorbed - max(sigma * t**4, 0.))
+        return out
+
+    @nb.njit(nogil=True, cache=True)
+    def _radiate_tile(t, absorbed_warm, absorbed_cold, sigma, dt, tol, max_substeps):
+        """Linearized-implicit sub-steps of one tile; returns (new temperature, sub-steps)
+        """
+        absorbed = absorbed_warm if t > FREEZING_TEMP else absorbed_cold
+        jacobian = 4 * sigma * max(t, 0.)**3
+        error = dt * dt * abs(absorbed - max(sigma * t**4, 0.)) * jacobian / (1 + dt * jacobian)
+        n = min(max_substeps, max(1, int(math.ceil(math.sqrt(error / tol)))))
+        h = dt / n
+        for _ in range(n):
+            absorbed = absorbed_warm if t > FREEZING_TEMP else absorbed_cold
+            jacobian = 4 * sigma * max(t, 0.)**3
+            t = t + h * (absorbed - max(sigma * t**4, 0.)) / (1 + h * jacobian)
+        return t, n
+
+    @nb.njit(parallel=True, nogil=True, cache=True)
+    def radiate_adaptive(temp, absorbed_warm, absorbed_cold, sigma, dt, tol, max_substeps, out, substeps):
+        for i in nb.prange(len(temp)):
+            out[i], substeps[i] = _radiate_tile(temp[i], absorbed_warm[i], absorbed_cold[i],
+                                                sigma, dt, tol, max_substeps)
+        return out
+
+    @nb.njit(parallel=True, nogil=True, cache=True)
+    def csr_matvec(indptr, indices, data, x, out):
+        for r in nb.prange(len(indptr) - 1):
+            acc = 0.
+            for k in range(indptr[r], indptr[r + 1]):
+                acc += data[k] * x[indices[k]]
+            out[r] = acc
+        return out
+
+    @nb.njit(parallel=True, nogil=True, cache=True)
+    def advance(temp, buf, absorbed_warm, absorbed_cold, indptr, indices, data, sigma, dt, n_steps):
+        for _ in range(n_steps):
+            for i in nb.prange(len(temp)):
+                t = temp[i]
+                absorbed = absorbed_warm[i] if t > FREEZING_TEMP else absorbed_cold[i]
+                buf[i] = t + dt * (absorbed - max(sigma * t**4, 0.))
+            for r in nb.prange(len(temp)):
+                acc = 0.
+                for k in range(indptr[r], indptr[r + 1]):
+                    acc += data[k] * buf[indices[k]]
+                temp[r] = acc
+        return temp
+
+    @nb.njit(parallel=True, nogil=True, cache=True)
+    def advance_adaptive(temp, buf, substeps, absorbed_warm, absorbed_cold, indptr, indices, data,
+                         sigma, dt, tol, max_substeps, n_steps):
+        for _ in range(n_steps):
+            for i in nb.prange(len(temp)):
+                buf[i], substeps[i] = _radiate_tile(temp[i], absorbed_warm[i], absorbed_cold[i],
+                                                    sigma, dt, tol, max_substeps)
+            for r in nb.prange(len(temp)):
+                acc = 0.
+                for k in range(indptr[r], indptr[r + 1]):
+                    acc += data[k] * buf[indices[k]]
+                temp[r] = acc
+        return temp
+
+    @nb.njit(nogil=True, cache=True)
+    def band_step(temp, out, buf, absorbed_warm, absorbed_cold, indptr, indices, data, sigma, dt):
+        for i in range(len(temp)):
+            t = temp[i]
+            absorbed = absorbed_warm[i] if t > FREEZING_TEMP else absorbed_cold[i]
+            buf[i] = t + dt * (absorbed - max(sigma * t**4, 0.))
+        for r in range(len(out)):
+            acc = 0.
+            for k in range(indptr[r], indptr[r + 1]):
+                acc += data[k] * buf[indices[k]]
+            out[r] = acc
+        return out
+
+    @nb.njit(nogil=True, cache=True)
+    def band_step_adaptive(temp, out, buf, substeps, absorbed_warm, absorbed_cold, indptr, indices, data,
+                           sigma, dt, tol, max_substeps):
+        for i in range(len(temp)):
+            buf[i], substeps[i] = _radiate_tile(temp[i], absorbed_warm[i], absorbed_cold[i],
+                                                sigma, dt, tol, max_substeps)
+        for r in range(len(out)):
+            acc = 0.
+            for k in range(indptr[r], indptr[r + 1]):
+                acc += data[k] * buf[indices[k]]
+            out[r] = acc
+        return out
+
+    @nb.njit(nogil=True, cache=True)
+    def tree_accumulate(order, receivers, coeff, rhs, out):
+        """Solve coeff[v] * out[v] = rhs[v] + sum of out[d] over the donors d of v
+
+        order lists every vertex after all of its donors.
+        """
+        out[:] = 0.
+        for v in order:
+            out[v] = (rhs[v] + out[v]) / coeff[v]
+            r = receivers[v]
+            if r != v:
+                out[r] += out[v]
+        return out
+
+    @nb.njit(nogil=True, cache=True)
+    def tree_implicit(order, receivers, coeff, rhs, out):
+        """Solve (1 + coeff[v]) * out[v] - coeff[v] * out[receivers[v]] = rhs[v]
+
+        Vertices draining to themselves must have coeff 0. order is swept backwards, so
+        each receiver is solved before its donors.
+        """
+        for k in range(len(order) - 1, -1, -1):
+            v = order[k]
+            r = receivers[v]
+            if r == v:
+                out[v] = rhs[v]
+            else:
+                out[v] = (rhs[v] + coeff[v] * out[r]) / (1 + coeff[v])
+        return out
+
+    @nb.njit(parallel=True, nogil=True, cache=True)
+    def exchange(surfacewater, groundwater, capacity, evaporation, precipitation, dt):
+        for i in nb.prange(len(surfacewater)):
+            s = surfacewater[i]
+            g = groundwater[i]
+            to_surface = max(0., g - capacity[i])
+            to_ground = min(s, max(0., capacity[i] - g))
+            s = s + to_surface - to_ground
+            s = s - min(dt * evaporation[i], s) + dt * precipitation[i]
+            surfacewater[i] = s
+            groundwater[i] = g - to_surface + to_ground
+        return surfacewater, groundwater
+
+else:
+    albedo = _albedo_numpy
+    albedo_serial = _albedo_numpy
+    frozen = _frozen_numpy
+    radiate = _radiate_numpy
+    csr_matvec = _csr_matvec_numpy
+    advance = _advance_numpy
+    band_step = _band_step_numpy
+    radiate_adaptive = _radiate_adaptive_numpy
+    advance_adaptive = _advance_adaptive_numpy
+    band_step_adaptive = _band_step_adaptive_numpy
+    exchange = _exchange_numpy
+    tree_accumulate = _tree_accumulate_numpy
+    tree_implicit = _tree_implicit_numpy
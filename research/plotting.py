@@ -0,0 +1,111 @@
+"""Matplotlib plotting of fields on a Geometry2D that reuses its artists between frames
+
+The notebooks' plot_function/plot_graph build a new Triangulation and a new figure for
+every field. A MeshPlotter builds the Triangulation (and its trifinder) once per mesh and
+keeps one artist per named field, so redrawing a field only swaps the artist's data:
+
+    plotter = MeshPlotter(geometry)
+    plotter.field("surfacewater", model.surfacewater, cmap="Blues")
+    plotter.vectors("flow", *gradient.reshape(2, -1))
+    model.run(1000, callback=plotter.monitor(surfacewater=lambda m: m.surfacewater, every=10))
+"""
+
+from functools import cached_property
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.tri as mtri
+
+
+class MeshPlotter:
+    """Live plots of vertex and face fields on one mesh
+
+    Fields are drawn with tripcolor and vector fields with quiver; calling field() or
+    vectors() again with the same name updates that artist in place (set_array, set_UVC).
+    """
+
+    def __init__(self, geometry, ax=None):
+        self.geometry = geometry
+        if ax is None:
+            _, ax = plt.subplots()
+        self.ax = ax
+        self.ax.set_aspect("equal")
+        self.artists = {}
+
+    @cached_property
+    def triangulation(self):
+        vertices = np.asarray(self.geometry.vertices)
+        return mtri.Triangulation(vertices[:, 0], vertices[:, 1], np.asarray(self.geometry.faces))
+
+    @cached_property
+    def trifinder(self):
+        return self.triangulation.get_trifinder()
+
+    def interpolate(self, values, x, y):
+        """Piecewise-linear interpolation of vertex values at points (x, y); masked outside the mesh
+        """
+        interpolator = mtri.LinearTriInterpolator(self.triangulation, values, trifinder=self.trifinder)
+        return interpolator(x, y)
+
+    def field(self, name, values, autoscale=True, **kwargs):
+        """Draw or update a scalar field of vertex values (gouraud) or face values (flat)
+
+        Keyword arguments go to tripcolor on the first call.
+        """
+        values = np.asarray(values)
+        artist = self.artists.get(name)
+        if artist is None:
+            shading = "gouraud" if len(values) == self.geometry.num_vertices else "flat"
+            if shading == "flat":
+                kwargs["facecolors"] = values
+                artist = self.ax.tripcolor(self.triangulation, shading=shading, **kwargs)
+            else:
+                artist = self.ax.tripcolor(self.triangulation, values, shading=shading, **kwargs)
+            self.artists[name] = artist
+            return artist
+        artist.set_array(values)
+        if autoscale:
+            artist.set_clim(values.min(), values.max())
+        return artist
+
+    def vectors(self, name, u, v, **kwargs):
+        """Draw or update a vector field given per face (at centroids) or per vertex
+
+        Keyword arguments go to quiver on the first call.
+        """
+        artist = self.artists.get(name)
+        if artist is None:
+            points = self.geometry.face_centroids if len(u) == self.geometry.num_faces else self.geometry.vertices
+            points = np.asarray(points)
+            artist = self.ax.quiver(points[:, 0], points[:, 1], u, v, **kwargs)
+            self.artists[name] = artist
+            return artist
+        artist.set_UVC(u, v)
+        return artist
+
+    def mesh(self, **kwargs):
+        """Draw the triangle edges once
+        """
+        if "mesh" not in self.artists:
+            self.artists["mesh"] = self.ax.triplot(self.triangulation, **kwargs)
+        return self.artists["mesh"]
+
+    def refresh(self):
+        """Redraw the figure without blocking, for use inside a running loop
+        """
+        canvas = self.ax.figure.canvas
+        canvas.draw_idle()
+        canvas.flush_events()
+        return
+
+    def monitor(self, every=1, **fields):
+        """Callback for HydrologyModel.run: every few steps, redraw fields computed from the model
+
+        fields maps a field name to a function of the model returning its values.
+        """
+        def callback(model, step):
+            if step % every:
+                return
+            for name, values in fields.items():
+                self.field(name, values(model))
+            self.refresh()
+        return callback
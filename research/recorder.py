@@ -0,0 +1,149 @@
+"""Streaming recorder: turns a running simulation into a GIF or video
+
+The simulation calls record(state) every step. Every stride-th state is copied onto a
+bounded queue, and a background thread renders it to an RGB frame and appends it to an
+imageio writer. Only the queued frames are ever held in memory. When the queue is full
+the simulation waits for the writer, or drops the frame if drop_when_full is set.
+If rendering or writing fails, the writer is closed and the error is raised from the
+next record() or close().
+"""
+
+import queue
+import threading
+import numpy as np
+import imageio
+import matplotlib.tri as mtri
+from matplotlib import cm
+
+
+_STOP = object()
+
+
+class Recorder:
+    """Background GIF/video writer fed from a simulation loop
+
+        with Recorder("run.gif", render, stride=10) as recorder:
+            for _ in range(n_steps):
+                step()
+                recorder.record(state)
+
+    render(state) must return an (height, width, 3) uint8 array; it runs on the writer
+    thread, on a copy of the recorded state. Extra keyword arguments go to imageio.get_writer.
+    """
+
+    def __init__(self, filename, render, stride=1, max_queued=16, drop_when_full=False, **writer_kwargs):
+        self.filename = filename
+        self.render = render
+        self.stride = stride
+        self.drop_when_full = drop_when_full
+        self.steps = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._writer = imageio.get_writer(filename, mode="I", **writer_kwargs)
+        self._thread = threading.Thread(target=self._write_frames, name=f"Recorder({filename})", daemon=True)
+        self._thread.start()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError(f"recording to {self.filename} failed") from self.error
+
+    def _put(self, item):
+        """Put item on the queue, waiting only while the writer thread is alive
+        """
+        while self._thread.is_alive():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def record(self, state):
+        """Offer the current state; only every stride-th call is kept
+        """
+        self._raise_error()
+        step = self.steps
+        self.steps += 1
+        if step % self.stride:
+            return
+        frame_state = np.array(state, copy=True)
+        if self.drop_when_full:
+            try:
+                self._queue.put_nowait(frame_state)
+            except queue.Full:
+                self.frames_dropped += 1
+        elif not self._put(frame_state):
+            self._raise_error()
+
+    def _write_frames(self):
+        try:
+            while True:
+                state = self._queue.get()
+                if state is _STOP:
+                    break
+                self._writer.append_data(self.render(state))
+                self.frames_written += 1
+        except BaseException as err:
+            self.error = err
+        finally:
+            try:
+                self._writer.close()
+            except BaseException as err:
+                if self.error is None:
+                    self.error = err
+
+    def close(self):
+        """Flush the queued frames and finish the file
+        """
+        self._put(_STOP)
+        self._thread.join()
+        self._raise_error()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MeshRasterizer:
+    """Renders vertex fields on a Geometry2D to RGB images
+
+    The triangle under each pixel and its barycentric weights are found once, so each
+    frame is a gather, a weighted sum and a colormap lookup.
+    """
+
+    def __init__(self, geometry, width=256, cmap="viridis", vmin=None, vmax=None, background=255):
+        x, y = geometry.vertices[:, 0], geometry.vertices[:, 1]
+        height = max(1, int(round(width * np.ptp(y) / np.ptp(x))))
+        px, py = np.meshgrid(np.linspace(x.min(), x.max(), width), np.linspace(y.max(), y.min(), height))
+        triangulation = mtri.Triangulation(x, y, geometry.faces)
+        face = triangulation.get_trifinder()(px, py)
+        self.shape = (height, width)
+        self.inside = face >= 0
+        self.corners = np.asarray(geometry.faces)[face[self.inside]]
+        # barycentric weights of each inside pixel in its face
+        p = np.asarray(geometry.vertices)[self.corners]
+        q = np.stack([px[self.inside], py[self.inside]], axis=1)
+        v0, v1, v2 = p[:, 1] - p[:, 0], p[:, 2] - p[:, 0], q - p[:, 0]
+        denom = v0[:, 0] * v1[:, 1] - v0[:, 1] * v1[:, 0]
+        w1 = (v2[:, 0] * v1[:, 1] - v2[:, 1] * v1[:, 0]) / denom
+        w2 = (v0[:, 0] * v2[:, 1] - v0[:, 1] * v2[:, 0]) / denom
+        self.weights = np.stack([1 - w1 - w2, w1, w2], axis=1)
+        self.lut = (255 * cm.get_cmap(cmap)(np.linspace(0, 1, 256))[:, :3]).astype(np.uint8)
+        self.vmin = vmin
+        self.vmax = vmax
+        self.background = background
+
+    def __call__(self, values):
+        values = np.asarray(values)
+        vmin = values.min() if self.vmin is None else self.vmin
+        vmax = values.max() if self.vmax is None else self.vmax
+        pixel_values = np.einsum("pk,pk->p", self.weights, values[self.corners])
+        scaled = np.clip((pixel_values - vmin) / max(vmax - vmin, 1e-12), 0, 1)
+        image = np.full(self.shape + (3,), self.background, dtype=np.uint8)
+        image[self.inside] = self.lut[(scaled * 255).astype(np.intp)]
+        return image
@@ -0,0 +1,107 @@
+"""Binary snapshot store for simulation state
+
+A store is a directory holding
+    meta.json         grid metadata plus the dtype and shape of every field
+    <field>.npy       the latest saved value of each field (memory-mappable)
+    <field>.frames    a time series of the field, one raw frame after another
+
+Frames are appended with a plain binary write, so checkpointing a long run is cheap,
+and read back as a memory map, so analysis can stream frames without loading the
+whole history.
+"""
+
+import json
+import os
+import numpy as np
+
+
+class SnapshotStore:
+    """Typed, memory-mappable state vectors with grid metadata and appendable time series
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                self._meta = json.load(f)
+        else:
+            self._meta = {"metadata": {}, "fields": {}, "series": {}}
+
+    @property
+    def metadata(self):
+        return self._meta["metadata"]
+
+    @property
+    def fields(self):
+        return sorted(self._meta["fields"])
+
+    @property
+    def series(self):
+        return sorted(self._meta["series"])
+
+    def _write_meta(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f"{self._meta_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._meta, f, indent=1)
+        os.replace(tmp_path, self._meta_path)
+
+    def save(self, fields, **metadata):
+        """Save each array in fields, replacing earlier values; metadata is merged into the store's
+        """
+        os.makedirs(self.path, exist_ok=True)
+        for name, value in fields.items():
+            value = np.ascontiguousarray(value)
+            np.save(os.path.join(self.path, f"{name}.npy"), value)
+            self._meta["fields"][name] = {"dtype": value.dtype.str, "shape": list(value.shape)}
+        self._meta["metadata"].update(metadata)
+        self._write_meta()
+        return
+
+    def load(self, names=None, mmap_mode="r"):
+        """Dict of saved fields (all of them if names is None), memory-mapped by default
+        """
+        names = self.fields if names is None else names
+        return {
+            name: np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in names
+        }
+
+    def append(self, fields):
+        """Append one frame to the time series of each array in fields
+
+        The first frame fixes the series' dtype and shape; later frames are cast to them.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        new_series = False
+        for name, value in fields.items():
+            if name not in self._meta["series"]:
+                value = np.asarray(value)
+                self._meta["series"][name] = {"dtype": value.dtype.str, "shape": list(value.shape)}
+                new_series = True
+            info = self._meta["series"][name]
+            frame = np.asarray(value, dtype=np.dtype(info["dtype"]))
+            if list(frame.shape) != info["shape"]:
+                raise ValueError(f"frame of {name} has shape {frame.shape}, expected {tuple(info['shape'])}")
+            with open(os.path.join(self.path, f"{name}.frames"), "ab") as f:
+                frame.tofile(f)
+        if new_series:
+            self._write_meta()
+        return
+
+    def num_frames(self, name):
+        info = self._meta["series"][name]
+        frame_bytes = np.dtype(info["dtype"]).itemsize * int(np.prod(info["shape"]))
+        # whole frames only, in case a write was interrupted
+        return os.path.getsize(os.path.join(self.path, f"{name}.frames")) // frame_bytes
+
+    def frames(self, name, mode="r"):
+        """Time series of a field as a memory map of shape (num_frames, *shape)
+        """
+        info = self._meta["series"][name]
+        shape = (self.num_frames(name), *info["shape"])
+        if shape[0] == 0:
+            return np.empty(shape, dtype=np.dtype(info["dtype"]))
+        return np.memmap(os.path.join(self.path, f"{name}.frames"), dtype=np.dtype(info["dtype"]),
+                         mode=mode, shape=shape)